@@ -3,20 +3,36 @@
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
+import hashlib
+import json
 import os
+import time
 
 from .database import get_db
+from .cache import MemoryBackend, bump_tags, tag_versions
+from .passwords import password_pool, pwd_context
 from . import models
 
 SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Authenticated user lookups are cached briefly per worker. A change made in
+# this worker bumps the user's tag and applies at once; changes made anywhere
+# else (another worker, a script, the database) apply within USER_CACHE_TTL.
+# Token claims are trusted for the same window, so that bound holds for
+# authorization too.
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "30"))
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_FIELDS = ("id", "email", "username", "full_name", "avatar_url", "role", "password_hash", "created_at")
+
+user_cache = MemoryBackend(USER_CACHE_SIZE)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -35,37 +51,126 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
+    to_encode.update({"exp": expire, "iat": datetime.utcnow()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def authenticate_user(db: Session, email: str, password: str):
-    """Authenticate user by email and password"""
-    user = db.query(models.User).filter(models.User.email == email).first()
+def user_tag(email: str) -> str:
+    return f"user:{email}"
+
+def user_stamp(user: models.User) -> str:
+    """Changes whenever the user's role or password hash does"""
+    return hashlib.sha256(f"{user.role}|{user.password_hash}".encode()).hexdigest()[:16]
+
+def create_user_token(user: models.User) -> str:
+    """
+    Access token for a user.
+
+    Besides the subject it carries the user id and role, which
+    get_current_identity() trusts without a lookup for USER_CACHE_TTL after
+    issue, and a stamp of the role and password hash: once the user row no
+    longer matches it, the token is rejected.
+    """
+    return create_access_token(data={
+        "sub": user.email,
+        "uid": user.id,
+        "role": user.role,
+        "stamp": user_stamp(user),
+    })
+
+async def authenticate_user(db: Session, email: str, password: str):
+    """
+    Authenticate user by email and password.
+
+    bcrypt runs in the password pool (PasswordPoolFull when it is saturated);
+    a hash made with outdated CryptContext parameters is replaced on success.
+    """
+    user = await run_in_threadpool(lambda: db.query(models.User).filter(models.User.email == email).first())
     if not user:
         return False
-    if not verify_password(password, user.password_hash):
+    valid, new_hash = await password_pool.verify(password, user.password_hash)
+    if not valid:
         return False
+    if new_hash:
+        def rehash():
+            user.password_hash = new_hash
+            db.commit()
+            db.refresh(user)
+        await run_in_threadpool(rehash)
     return user
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    """Get current authenticated user from JWT token"""
-    credentials_exception = HTTPException(
+def _credentials_exception():
+    return HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    
+
+def decode_token(token: str = Depends(oauth2_scheme)) -> dict:
+    """Validated JWT claims"""
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    
+        raise _credentials_exception()
+    if payload.get("sub") is None:
+        raise _credentials_exception()
+    return payload
+
+def _load_user(db: Session, email: str, version: str) -> models.User:
+    key = f"{user_tag(email)}#{version}"
+    cached = user_cache.get(key)
+    if cached is not None:
+        values = json.loads(cached)
+        values["created_at"] = values["created_at"] and datetime.fromisoformat(values["created_at"])
+        return models.User(**values)  # transient copy, not attached to the session
+
     user = db.query(models.User).filter(models.User.email == email).first()
     if user is None:
-        raise credentials_exception
-    
+        raise _credentials_exception()
+    values = {field: getattr(user, field) for field in USER_CACHE_FIELDS}
+    values["created_at"] = values["created_at"] and values["created_at"].isoformat()
+    user_cache.set(key, json.dumps(values).encode(), USER_CACHE_TTL)
+    return user
+
+def get_current_user(payload: dict = Depends(decode_token), db: Session = Depends(get_db)):
+    """Get current authenticated user from JWT token"""
+    email = payload["sub"]
+    user = _load_user(db, email, tag_versions([user_tag(email)]))
+    if "stamp" in payload and payload["stamp"] != user_stamp(user):
+        raise _credentials_exception()  # role or password changed since the token was issued
     return user
+
+def get_current_identity(payload: dict = Depends(decode_token), db: Session = Depends(get_db)):
+    """
+    Current user's id and role, for endpoints that only authorize.
+
+    The claims of a token issued by create_user_token() are used as they are
+    while it is younger than USER_CACHE_TTL; after that (or for older tokens)
+    this is get_current_user().
+    """
+    issued_at = payload.get("iat")
+    if payload.get("uid") and "stamp" in payload and issued_at is not None and time.time() - issued_at < USER_CACHE_TTL:
+        return models.User(id=payload["uid"], email=payload["sub"], role=payload.get("role"))
+    return get_current_user(payload, db)
+
+# ==================== INVALIDATION ====================
+
+@event.listens_for(models.User, "after_update")
+@event.listens_for(models.User, "after_delete")
+def _user_changed(mapper, connection, target):
+    # Collected per session and bumped after commit, so no request can
+    # re-cache the old row between the flush and the commit
+    emails = {target.email, *inspect(target).attrs.email.history.deleted}
+    session = inspect(target).session
+    if session is not None:
+        session.info.setdefault("changed_users", set()).update(emails)
+
+@event.listens_for(Session, "after_commit")
+def _bump_changed_users(session):
+    emails = session.info.pop("changed_users", None)
+    if emails:
+        bump_tags(*(user_tag(email) for email in emails if email))
+
+@event.listens_for(Session, "after_rollback")
+def _forget_changed_users(session):
+    session.info.pop("changed_users", None)
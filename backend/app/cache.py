@@ -0,0 +1,252 @@
+"""
+Cache backends
+In-process LRU, shared SQLite file and Redis-protocol stores behind one interface,
+plus versioned tags so an invalidation on one worker is seen by all of them
+"""
+
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import urlparse
+
+# memory:// (per process), sqlite:///path/to/cache.db, redis://host:6379/0
+CACHE_URL = os.getenv("CACHE_URL", "memory://")
+MEMORY_CACHE_SIZE = int(os.getenv("MEMORY_CACHE_SIZE", "4096"))
+MEMORY_CACHE_MAX_BYTES = int(os.getenv("MEMORY_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# How long read replicas may lag the primary: a client that wrote reads from
+# the primary this long, and responses read from a replica this soon after a
+# tag was bumped are not cached under it
+READ_YOUR_WRITES_SECONDS = float(os.getenv("READ_YOUR_WRITES_SECONDS", "5"))
+
+
+class CacheBackend:
+    """Byte-value key/value store with optional per-key TTL and integer counters"""
+
+    shared = False
+
+    def get(self, key: str) -> Optional[bytes]:
+        raise NotImplementedError
+
+    def get_many(self, keys: List[str]) -> Dict[str, bytes]:
+        return {k: v for k in keys if (v := self.get(k)) is not None}
+
+    def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """
+    Thread-safe LRU bounded by entry count and total bytes.
+
+    Counters live outside the LRU: evicting a tag version would reset it
+    and make stale entries reachable again.
+    """
+
+    def __init__(self, max_entries: int = MEMORY_CACHE_SIZE, max_bytes: int = MEMORY_CACHE_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._counters: Dict[str, int] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self._counters:
+                return self._counters[key]
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._counters.pop(key, None)
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + ttl if ttl else None)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+
+    def _remove(self, key):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(value)
+
+    def delete(self, key):
+        with self._lock:
+            self._counters.pop(key, None)
+            if key in self._entries:
+                self._remove(key)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self._bytes}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Cache in a local SQLite file shared by every worker on the host.
+
+    WAL mode lets readers proceed while one worker writes; each thread keeps
+    its own connection.
+    """
+
+    shared = True
+    PURGE_EVERY = 1000
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB, expires_at REAL)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._conn().execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+            (key, time.time())
+        ).fetchone()
+        return row[0] if row else None
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        marks = ",".join("?" * len(keys))
+        rows = self._conn().execute(
+            f"SELECT key, value FROM cache WHERE key IN ({marks}) AND (expires_at IS NULL OR expires_at > ?)",
+            (*keys, time.time())
+        ).fetchall()
+        return dict(rows)
+
+    def set(self, key, value, ttl=None):
+        conn = self._conn()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, value, time.time() + ttl if ttl else None)
+        )
+        self._writes += 1
+        if self._writes % self.PURGE_EVERY == 0:
+            conn.execute("DELETE FROM cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def incr(self, key):
+        return self._conn().execute(
+            "INSERT INTO cache (key, value, expires_at) VALUES (?, 1, NULL) "
+            "ON CONFLICT(key) DO UPDATE SET value = CAST(value AS INTEGER) + 1 RETURNING value",
+            (key,)
+        ).fetchone()[0]
+
+
+class RedisBackend(CacheBackend):
+    """Any server speaking the Redis protocol (Redis, Valkey, KeyDB, ...); needs the `redis` package"""
+
+    shared = True
+
+    def __init__(self, url: str):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_URL uses redis:// but the 'redis' package is not installed")
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key):
+        return self.client.get(key)
+
+    def get_many(self, keys):
+        if not keys:
+            return {}
+        return {k: v for k, v in zip(keys, self.client.mget(keys)) if v is not None}
+
+    def set(self, key, value, ttl=None):
+        if ttl:
+            self.client.set(key, value, px=int(ttl * 1000))
+        else:
+            self.client.set(key, value)
+
+    def delete(self, key):
+        self.client.delete(key)
+
+    def incr(self, key):
+        return self.client.incr(key)
+
+
+def get_backend(url: str = CACHE_URL) -> CacheBackend:
+    """Build a backend from a cache URL"""
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBackend()
+    if parsed.scheme == "sqlite":
+        return SQLiteBackend(url[len("sqlite:///"):] or "cache.db")
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisBackend(url)
+    raise ValueError(f"Unsupported CACHE_URL: {url}")
+
+
+shared_cache = get_backend()
+
+# ==================== VERSIONED TAGS ====================
+
+def tag_versions(tags: Iterable[str], backend: CacheBackend = None) -> str:
+    """
+    Current version stamp of a set of tags, for building cache keys.
+
+    Keys embed the versions of the tags they depend on; bumping a tag makes
+    every key built from the old version unreachable on all workers at once,
+    with no need to find and delete the entries themselves.
+    """
+    backend = backend or shared_cache
+    tags = sorted(set(tags))
+    found = backend.get_many([f"tagv:{t}" for t in tags])
+    return ".".join(str(int(found.get(f"tagv:{t}", 0))) for t in tags)
+
+def bump_tags(*tags: str, backend: CacheBackend = None):
+    """Invalidate everything cached under any of the tags, on every worker"""
+    backend = backend or shared_cache
+    for tag in set(tags):
+        backend.incr(f"tagv:{tag}")
+        backend.set(f"tagb:{tag}", b"1", READ_YOUR_WRITES_SECONDS)
+
+def recently_bumped(tags: Iterable[str], backend: CacheBackend = None) -> bool:
+    """
+    Whether any of the tags was bumped in the last READ_YOUR_WRITES_SECONDS.
+
+    A replica may not have the write behind that bump yet, so what it serves
+    must not be cached under the new tag version.
+    """
+    backend = backend or shared_cache
+    return bool(backend.get_many([f"tagb:{t}" for t in set(tags)]))
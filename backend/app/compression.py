@@ -0,0 +1,324 @@
+"""
+Compressed text columns
+Transparent zlib/zstd compression for large text columns (post Markdown, MDX and HTML)
+
+    python -m app.compression migrate [--vacuum]
+    python -m app.compression train ./posts.zdict [--size BYTES]
+    python -m app.compression benchmark [--sample N]
+"""
+
+import argparse
+import os
+import threading
+import time
+import zlib
+from typing import Dict, List, Optional, Union
+
+from sqlalchemy import LargeBinary, bindparam, func, text, update
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator
+
+# zlib (stdlib), zstd (needs the `zstandard` package) or none
+CONTENT_COMPRESSION = os.getenv("CONTENT_COMPRESSION", "zlib")
+CONTENT_COMPRESSION_LEVEL = int(os.getenv("CONTENT_COMPRESSION_LEVEL", "6"))
+# Values shorter than this are stored as plain UTF-8 - not worth a codec header
+CONTENT_COMPRESSION_MIN_BYTES = int(os.getenv("CONTENT_COMPRESSION_MIN_BYTES", "256"))
+# Comma-separated zstd dictionary files. The first one compresses new values;
+# keep older ones listed after retraining so rows written with them still read.
+CONTENT_ZSTD_DICTS = [p for p in os.getenv("CONTENT_ZSTD_DICTS", "").split(",") if p]
+
+# Stored values start with MAGIC + one codec byte. Text never starts with NUL,
+# so anything else is a row written before compression and is plain UTF-8.
+MAGIC = b"\x00"
+RAW, ZLIB, ZSTD = b"n", b"z", b"s"
+
+COMPRESSED_COLUMNS = ("content", "content_mdx", "content_html")
+MIGRATE_BATCH = 200
+
+
+def _zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("CONTENT_COMPRESSION=zstd needs the 'zstandard' package")
+    return zstandard
+
+
+def load_dictionaries(paths: List[str]) -> list:
+    zstandard = _zstandard()
+    dictionaries = []
+    for path in paths:
+        with open(path, "rb") as f:
+            dictionaries.append(zstandard.ZstdCompressionDict(f.read()))
+    return dictionaries
+
+
+class ZstdCodec:
+    """
+    zstd with optional trained dictionaries.
+
+    Frames record the id of the dictionary they were made with, so one codec
+    reads values written under every configured dictionary. zstandard
+    (de)compressors are not thread-safe; each thread keeps its own.
+    """
+
+    def __init__(self, level: int = CONTENT_COMPRESSION_LEVEL, dictionaries: Optional[list] = None):
+        self.level = level
+        if dictionaries is None:
+            dictionaries = load_dictionaries(CONTENT_ZSTD_DICTS)
+        self.dictionaries = {d.dict_id(): d for d in dictionaries}
+        self.dictionary = dictionaries[0] if dictionaries else None
+        self._local = threading.local()
+
+    def compress(self, data: bytes) -> bytes:
+        compressor = getattr(self._local, "compressor", None)
+        if compressor is None:
+            compressor = self._local.compressor = _zstandard().ZstdCompressor(
+                level=self.level, dict_data=self.dictionary
+            )
+        return compressor.compress(data)
+
+    def decompress(self, data: bytes) -> bytes:
+        zstandard = _zstandard()
+        dict_id = zstandard.get_frame_parameters(data).dict_id
+        decompressors = getattr(self._local, "decompressors", None)
+        if decompressors is None:
+            decompressors = self._local.decompressors = {}
+        decompressor = decompressors.get(dict_id)
+        if decompressor is None:
+            if dict_id and dict_id not in self.dictionaries:
+                raise RuntimeError(f"Value compressed with zstd dictionary {dict_id}, which is not in CONTENT_ZSTD_DICTS")
+            decompressor = decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=self.dictionaries.get(dict_id))
+        return decompressor.decompress(data)
+
+
+class ZlibCodec:
+    def __init__(self, level: int = CONTENT_COMPRESSION_LEVEL):
+        self.level = level
+
+    def compress(self, data: bytes) -> bytes:
+        return zlib.compress(data, self.level)
+
+    def decompress(self, data: bytes) -> bytes:
+        return zlib.decompress(data)
+
+
+_CODEC_TAGS = {"zlib": ZLIB, "zstd": ZSTD, "none": RAW}
+_codecs: Dict[bytes, object] = {}
+_codecs_lock = threading.Lock()
+
+def _codec(tag: bytes):
+    # Built on first use, so a zlib deployment never needs zstandard installed
+    codec = _codecs.get(tag)
+    if codec is None:
+        with _codecs_lock:
+            codec = _codecs.get(tag)
+            if codec is None:
+                codec = _codecs[tag] = ZstdCodec() if tag == ZSTD else ZlibCodec()
+    return codec
+
+def encode(value: str, codec: str = CONTENT_COMPRESSION) -> bytes:
+    tag = _CODEC_TAGS.get(codec)
+    if tag is None:
+        raise ValueError(f"Unsupported CONTENT_COMPRESSION: {codec}")
+    data = value.encode("utf-8")
+    if tag == RAW or len(data) < CONTENT_COMPRESSION_MIN_BYTES:
+        return MAGIC + RAW + data
+    compressed = _codec(tag).compress(data)
+    if len(compressed) >= len(data):  # incompressible (already tiny or random)
+        return MAGIC + RAW + data
+    return MAGIC + tag + compressed
+
+def decode(value: Union[bytes, str]) -> str:
+    if isinstance(value, str):  # legacy row in a TEXT column (SQLite keeps it as text)
+        return value
+    value = bytes(value)
+    if not value.startswith(MAGIC):  # legacy row converted to bytea by migrate()
+        return value.decode("utf-8")
+    tag, payload = value[1:2], value[2:]
+    if tag == RAW:
+        return payload.decode("utf-8")
+    if tag not in (ZLIB, ZSTD):
+        raise ValueError(f"Unknown compressed text codec {tag!r}")
+    return _codec(tag).decompress(payload).decode("utf-8")
+
+
+class CompressedText(TypeDecorator):
+    """
+    Text stored as a compressed blob.
+
+    Reads and writes look like a plain Text column to the rest of the app.
+    Values are only compared by the application, never in SQL, so the stored
+    bytes need not be comparable or searchable.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else encode(value)
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else decode(value)
+
+# ==================== MIGRATION ====================
+
+def convert_columns(db: Session) -> List[str]:
+    """
+    Change TEXT columns to bytea on PostgreSQL (existing values become their
+    UTF-8 bytes, which decode() reads as legacy rows). SQLite stores blobs in
+    the existing columns as they are and needs no DDL.
+    """
+    if db.get_bind().dialect.name != "postgresql":
+        return []
+    converted = []
+    for column in COMPRESSED_COLUMNS:
+        data_type = db.execute(text(
+            "SELECT data_type FROM information_schema.columns WHERE table_name = 'posts' AND column_name = :column"
+        ), {"column": column}).scalar()
+        if data_type == "text":
+            db.execute(text(f"ALTER TABLE posts ALTER COLUMN {column} TYPE bytea USING convert_to({column}, 'UTF8')"))
+            converted.append(column)
+    db.commit()
+    return converted
+
+def recompress_posts(db: Session, batch: int = MIGRATE_BATCH) -> int:
+    """
+    Rewrite every post's content columns with the current codec, in keyset
+    batches of one transaction each. Safe to rerun - after switching codec
+    or training a new dictionary too. updated_at is left alone.
+    """
+    from . import models
+
+    posts = models.Post.__table__
+    statement = (
+        update(posts)
+        .where(posts.c.id == bindparam("b_id"))
+        .values(updated_at=posts.c.updated_at, **{c: bindparam(f"b_{c}") for c in COMPRESSED_COLUMNS})
+    )
+    rewritten, last_id = 0, None
+    while True:
+        query = db.query(posts.c.id, *(posts.c[c] for c in COMPRESSED_COLUMNS)).order_by(posts.c.id)
+        if last_id is not None:
+            query = query.filter(posts.c.id > last_id)
+        rows = query.limit(batch).all()
+        if not rows:
+            return rewritten
+        db.execute(statement, [
+            {"b_id": row.id, **{f"b_{c}": getattr(row, c) for c in COMPRESSED_COLUMNS}} for row in rows
+        ])
+        db.commit()
+        rewritten += len(rows)
+        last_id = rows[-1].id
+
+def table_bytes(db: Session) -> Optional[int]:
+    """On-disk size of the posts table (PostgreSQL, incl. TOAST) or the whole SQLite file"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        return db.execute(text("SELECT pg_total_relation_size('posts')")).scalar()
+    if dialect == "sqlite":
+        return db.execute(text("PRAGMA page_count")).scalar() * db.execute(text("PRAGMA page_size")).scalar()
+    return None
+
+# ==================== DICTIONARY / BENCHMARK ====================
+
+def _sample(db: Session, limit: int) -> List[str]:
+    from . import models
+
+    rows = db.query(models.Post.content, models.Post.content_mdx, models.Post.content_html).order_by(
+        models.Post.created_at.desc()
+    ).limit(limit).all()
+    return [value for row in rows for value in row if value]
+
+def train_dictionary(db: Session, path: str, size: int = 112640, sample: int = 2000) -> int:
+    """Train a zstd dictionary on recent posts and write it to path; returns its id"""
+    zstandard = _zstandard()
+    samples = [value.encode("utf-8") for value in _sample(db, sample)]
+    dictionary = zstandard.train_dictionary(size, samples)
+    with open(path, "wb") as f:
+        f.write(dictionary.as_bytes())
+    return dictionary.dict_id()
+
+def benchmark(db: Session, sample: int = 500) -> List[dict]:
+    """Stored size and (de)compression cost of each available codec on recent posts"""
+    from . import models
+
+    started = time.perf_counter()
+    values = _sample(db, sample)
+    fetch_seconds = time.perf_counter() - started
+    data = [value.encode("utf-8") for value in values]
+
+    codecs = [("none", None), ("zlib", ZlibCodec())]
+    try:
+        zstandard = _zstandard()
+    except RuntimeError:
+        zstandard = None
+    if zstandard is not None:
+        codecs.append(("zstd", ZstdCodec(dictionaries=[])))
+        if len(data) >= 8:
+            codecs.append(("zstd+dict", ZstdCodec(dictionaries=[zstandard.train_dictionary(112640, data)])))
+
+    results = []
+    for name, codec in codecs:
+        started = time.perf_counter()
+        blobs = [codec.compress(value) for value in data] if codec else data
+        compress_seconds = time.perf_counter() - started
+        started = time.perf_counter()
+        for blob in blobs:
+            if codec:
+                codec.decompress(blob)
+        decompress_seconds = time.perf_counter() - started
+        results.append({
+            "codec": name,
+            "values": len(data),
+            "bytes": sum(len(blob) for blob in blobs),
+            "ratio": round(sum(map(len, data)) / max(1, sum(len(blob) for blob in blobs)), 2),
+            "compress_us": round(compress_seconds / max(1, len(data)) * 1e6, 1),
+            "decompress_us": round(decompress_seconds / max(1, len(data)) * 1e6, 1),
+        })
+    # What the database holds now, and the time to fetch (and decode) the sample
+    results.append({
+        "stored_as": CONTENT_COMPRESSION,
+        "posts": db.query(func.count(models.Post.id)).scalar(),
+        "table_bytes": table_bytes(db),
+        "sample_fetch_ms": round(fetch_seconds * 1000, 1),
+    })
+    return results
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Compressed post content: migrate, train a dictionary, benchmark")
+    commands = parser.add_subparsers(dest="command", required=True)
+    migrate = commands.add_parser("migrate", help="convert columns and recompress every post")
+    migrate.add_argument("--vacuum", action="store_true", help="reclaim freed space afterwards")
+    train = commands.add_parser("train", help="train a zstd dictionary on recent posts")
+    train.add_argument("path")
+    train.add_argument("--size", type=int, default=112640)
+    train.add_argument("--sample", type=int, default=2000)
+    bench = commands.add_parser("benchmark", help="compare codecs on recent posts")
+    bench.add_argument("--sample", type=int, default=500)
+    args = parser.parse_args()
+
+    session = SessionLocal()
+    try:
+        if args.command == "migrate":
+            before = table_bytes(session)
+            converted = convert_columns(session)
+            count = recompress_posts(session)
+            if args.vacuum:
+                engine = session.get_bind()
+                with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+                    conn.execute(text("VACUUM" if engine.dialect.name == "sqlite" else "VACUUM posts"))
+            print(f"✅ Recompressed {count} posts with {CONTENT_COMPRESSION}"
+                  + (f" (converted {', '.join(converted)} to bytea)" if converted else "")
+                  + (f"; size {before} → {table_bytes(session)} bytes" if before is not None else ""))
+        elif args.command == "train":
+            dict_id = train_dictionary(session, args.path, args.size, args.sample)
+            print(f"✅ Wrote zstd dictionary {dict_id} to {args.path} - add it to CONTENT_ZSTD_DICTS")
+        else:
+            for row in benchmark(session, args.sample):
+                print("  ".join(f"{k}={v}" for k, v in row.items()))
+    finally:
+        session.close()
@@ -2,13 +2,21 @@
 CRUD operations for all database models
 """
 
-from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
-from typing import List, Optional
-from datetime import datetime
+import os
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, joinedload, load_only, selectinload
+from sqlalchemy import bindparam, func, insert, select, update
+from typing import Dict, List, Optional
+from datetime import date, datetime, time, timedelta
+from functools import lru_cache
+from pydantic import TypeAdapter
 import uuid
 
-from . import models, schemas
+from . import models, schemas, search_index, rendering, postprocess
+from .cache import MemoryBackend, recently_bumped
+from .response_cache import CacheEntry, ResponseCache, invalidate, post_tags
+from .pagination import InvalidCursor, after_time_cursor, decode_cursor, encode_cursor, time_page
 from .auth import get_password_hash
 
 # ==================== USER CRUD ====================
@@ -19,13 +27,12 @@ def get_user(db: Session, user_id: str):
 def get_user_by_email(db: Session, email: str):
     return db.query(models.User).filter(models.User.email == email).first()
 
-def create_user(db: Session, user: schemas.UserCreate):
-    hashed_password = get_password_hash(user.password)
+def create_user(db: Session, user: schemas.UserCreate, password_hash: Optional[str] = None):
     db_user = models.User(
         email=user.email,
         username=user.username,
         full_name=user.full_name,
-        password_hash=hashed_password
+        password_hash=password_hash or get_password_hash(user.password)
     )
     db.add(db_user)
     db.commit()
@@ -34,86 +41,293 @@ def create_user(db: Session, user: schemas.UserCreate):
 
 # ==================== POST CRUD ====================
 
+# Relationship loading per response schema. PostDetail serializes author,
+# categories and tags, so they are fetched up front (author joined, the two
+# collections with one IN query each) instead of lazily per attribute access.
+# PostSummary (listings) selects only the card columns: content, content_mdx
+# and content_html stay in the database.
+POST_SUMMARY_COLUMNS = (
+    models.Post.id,
+    models.Post.title,
+    models.Post.slug,
+    models.Post.excerpt,
+    models.Post.featured_image,
+    models.Post.status,
+    models.Post.author_id,
+    models.Post.views_count,
+    models.Post.reading_time,
+    models.Post.rating_sum,
+    models.Post.rating_count,
+    models.Post.created_at,
+    models.Post.published_at,
+    models.Post.updated_at,
+)
+
+POST_LOAD_PROFILES = {
+    schemas.PostSummary: (load_only(*POST_SUMMARY_COLUMNS),),
+    schemas.Post: (),
+    schemas.PostDetail: (
+        joinedload(models.Post.author),
+        selectinload(models.Post.categories),
+        selectinload(models.Post.tags),
+    ),
+}
+
+def post_query(db: Session, schema=schemas.Post):
+    return db.query(models.Post).options(*POST_LOAD_PROFILES[schema])
+
+def summary_dict(row) -> dict:
+    """PostSummary fields of a POST_SUMMARY_COLUMNS row, without model validation"""
+    return {
+        "id": row.id,
+        "title": row.title,
+        "slug": row.slug,
+        "excerpt": row.excerpt,
+        "featured_image": row.featured_image,
+        "status": row.status,
+        "author_id": row.author_id,
+        "views_count": row.views_count,
+        "reading_time": row.reading_time,
+        "average_rating": round(row.rating_sum / row.rating_count, 2) if row.rating_count else 0.0,
+        "rating_count": row.rating_count,
+        "created_at": row.created_at,
+        "published_at": row.published_at,
+    }
+
 def get_posts(
     db: Session,
     skip: int = 0,
     limit: int = 20,
     status: Optional[str] = None,
     category: Optional[str] = None,
-    tag: Optional[str] = None,
-    search: Optional[str] = None
+    tag: Optional[List[str]] = None,
+    search: Optional[str] = None,
+    cursor: Optional[str] = None,
+    tag_match: str = "any",
+    schema=schemas.PostSummary
 ):
-    query = db.query(models.Post)
-    
+    return _post_page(
+        post_query(db, schema), db, skip, limit, status, category, tag, search, cursor, tag_match
+    )
+
+def get_post_cards(db: Session, skip: int = 0, limit: int = 20, cursor: Optional[str] = None, **filters) -> dict:
+    """get_posts as plain dicts from a column query - no ORM objects, no per-row validation"""
+    page = _post_page(db.query(*POST_SUMMARY_COLUMNS), db, skip, limit, cursor=cursor, **filters)
+    page["items"] = [summary_dict(row) for row in page["items"]]
+    return page
+
+def _post_page(query, db: Session, skip: int, limit: int, status: Optional[str] = None,
+               category: Optional[str] = None, tag: Optional[List[str]] = None, search: Optional[str] = None,
+               cursor: Optional[str] = None, tag_match: str = "any") -> dict:
     if status:
         query = query.filter(models.Post.status == status)
     
-    if search:
-        query = query.filter(
-            or_(
-                models.Post.title.contains(search),
-                models.Post.content.contains(search)
-            )
+    if category:
+        query = query.filter(models.Post.id.in_(
+            select(models.post_categories.c.post_id)
+            .join(models.Category, models.Category.id == models.post_categories.c.category_id)
+            .where(models.Category.slug == category)
+        ))
+    
+    if tag:
+        tag_posts = (
+            select(models.post_tags.c.post_id)
+            .join(models.Tag, models.Tag.id == models.post_tags.c.tag_id)
+            .where(models.Tag.slug.in_(tag))
         )
+        if tag_match == "all":
+            # Posts carrying every requested tag
+            tag_posts = tag_posts.group_by(models.post_tags.c.post_id).having(
+                func.count(models.post_tags.c.tag_id) == len(set(tag))
+            )
+        query = query.filter(models.Post.id.in_(tag_posts))
+    
+    if search:
+        query = query.filter(models.Post.id.in_(search_index.matching_post_ids(db, search)))
     
-    return query.order_by(models.Post.created_at.desc()).offset(skip).limit(limit).all()
+    query = after_time_cursor(query, models.Post, cursor)
+    if skip and not cursor:
+        query = query.offset(skip)
+    return time_page(query.limit(limit + 1).all(), limit)
 
 def get_post(db: Session, post_id: str):
     return db.query(models.Post).filter(models.Post.id == post_id).first()
 
-def get_post_by_slug(db: Session, slug: str):
-    return db.query(models.Post).filter(models.Post.slug == slug).first()
+def get_post_by_slug(db: Session, slug: str, schema=schemas.Post):
+    return post_query(db, schema).filter(models.Post.slug == slug).first()
+
+def _adjust_post_counts(db: Session, category_ids, tag_ids, delta: int):
+    # Maintained counters of published posts per category/tag
+    if category_ids:
+        db.execute(update(models.Category).where(models.Category.id.in_(category_ids)).values(
+            post_count=models.Category.post_count + delta
+        ))
+    if tag_ids:
+        db.execute(update(models.Tag).where(models.Tag.id.in_(tag_ids)).values(
+            post_count=models.Tag.post_count + delta
+        ))
+
+def _published_taxonomy(db_post: models.Post):
+    if db_post.status != "published":
+        return set(), set()
+    return {c.id for c in db_post.categories}, {t.id for t in db_post.tags}
+
+def _set_post_taxonomy(db: Session, db_post: models.Post, category_ids, tag_ids):
+    if category_ids is not None:
+        ids = [str(i) for i in category_ids]
+        db_post.categories = db.query(models.Category).filter(models.Category.id.in_(ids)).all() if ids else []
+    if tag_ids is not None:
+        ids = [str(i) for i in tag_ids]
+        db_post.tags = db.query(models.Tag).filter(models.Tag.id.in_(ids)).all() if ids else []
 
 def create_post(db: Session, post: schemas.PostCreate, author_id: str):
+    data = post.dict(exclude={"category_ids", "tag_ids"})
+    data["content_mdx"] = data["content_mdx"] or data["content"]
     db_post = models.Post(
-        **post.dict(),
+        **data,
         author_id=author_id,
         published_at=datetime.utcnow() if post.status == "published" else None
     )
+    rendering.render_post(db, db_post)
+    postprocess.apply_metadata(db_post, regenerate_excerpt=not post.excerpt)
+    _set_post_taxonomy(db, db_post, post.category_ids, post.tag_ids)
     db.add(db_post)
+    db.flush()
+    _adjust_post_counts(db, *_published_taxonomy(db_post), 1)
+    search_index.index_post(db, db_post)
     db.commit()
+    invalidate("posts", "categories", "tags")
     db.refresh(db_post)
     return db_post
 
 def update_post(db: Session, post_id: str, post: schemas.PostUpdate):
     db_post = get_post(db, post_id)
     if db_post:
-        for key, value in post.dict(exclude_unset=True).items():
+        old_categories, old_tags = _published_taxonomy(db_post)
+        data = post.dict(exclude_unset=True)
+        _set_post_taxonomy(db, db_post, data.pop("category_ids", None), data.pop("tag_ids", None))
+        for key, value in data.items():
             setattr(db_post, key, value)
+        render_diff = rendering.render_post(db, db_post)
+        if "excerpt" in data:
+            db_post.excerpt_generated = not data["excerpt"]
+        if render_diff is not None or ("excerpt" in data and not data["excerpt"]):
+            postprocess.apply_metadata(db_post, regenerate_excerpt=bool(db_post.excerpt_generated))
         db_post.updated_at = datetime.utcnow()
+        new_categories, new_tags = _published_taxonomy(db_post)
+        _adjust_post_counts(db, old_categories - new_categories, old_tags - new_tags, -1)
+        _adjust_post_counts(db, new_categories - old_categories, new_tags - old_tags, 1)
+        search_index.index_post(db, db_post)
         db.commit()
+        invalidate(*post_tags(db_post), "categories", "tags")
         db.refresh(db_post)
+        db_post.render_diff = render_diff
     return db_post
 
 def delete_post(db: Session, post_id: str):
     db_post = get_post(db, post_id)
     if db_post:
+        _adjust_post_counts(db, *_published_taxonomy(db_post), -1)
+        search_index.remove_post(db, post_id)
+        tags = post_tags(db_post)
         db.delete(db_post)
         db.commit()
+        invalidate(*tags, f"comments:{post_id}", "categories", "tags")
     return True
 
-def increment_post_views(db: Session, post_id: str):
-    db_post = get_post(db, post_id)
-    if db_post:
-        db_post.views_count += 1
+def get_post_html(db: Session, slug: str):
+    # (hash, html) for a post, rendering it first if it predates server-side
+    # rendering or was rendered by an older renderer version
+    row = db.query(models.Post.id, models.Post.content, models.Post.content_hash, models.Post.content_html).filter(
+        models.Post.slug == slug
+    ).first()
+    if row is None:
+        return None
+    if not rendering.is_current(row):
+        db_post = get_post(db, row.id)
+        rendering.render_post(db, db_post)
         db.commit()
-    return db_post
+        return db_post.content_hash, db_post.content_html
+    return row.content_hash, row.content_html
+
+def add_post_views(db: Session, counts: Dict[str, int]):
+    # One batched `views_count = views_count + n` UPDATE per post, single transaction.
+    # updated_at is kept: it tracks content changes (static export, sitemaps), not counters
+    posts = models.Post.__table__
+    db.execute(
+        update(posts)
+        .where(posts.c.id == bindparam("b_post_id"))
+        .values(
+            views_count=func.coalesce(posts.c.views_count, 0) + bindparam("b_views"),
+            updated_at=posts.c.updated_at
+        ),
+        [{"b_post_id": post_id, "b_views": n} for post_id, n in counts.items()]
+    )
+    db.commit()
 
 # ==================== COMMENT CRUD ====================
 
-def get_post_comments(db: Session, post_id: str):
-    return db.query(models.Comment).filter(
+def get_post_comments(db: Session, post_id: str, limit: int = 50, cursor: Optional[str] = None):
+    query = db.query(models.Comment).filter(
         models.Comment.post_id == post_id,
         models.Comment.status == "approved"
-    ).order_by(models.Comment.created_at.desc()).all()
+    )
+    query = after_time_cursor(query, models.Comment, cursor)
+    return time_page(query.limit(limit + 1).all(), limit)
+
+def get_comment_threads(db: Session, post_id: str, limit: int = 20, cursor: Optional[str] = None):
+    """
+    A page of approved top-level comments with their whole reply trees, in one query.
+
+    The anchor of a recursive CTE picks the page of thread roots (newest
+    first, keyset paged like get_post_comments) and the recursive step
+    walks approved replies down parent_id. Replies under a comment that is
+    not approved are not shown. Threads are nested here, replies oldest first.
+    """
+    roots = after_time_cursor(
+        db.query(models.Comment.id).filter(
+            models.Comment.post_id == post_id,
+            models.Comment.parent_id.is_(None),
+            models.Comment.status == "approved"
+        ),
+        models.Comment,
+        cursor
+    ).limit(limit + 1).subquery()
+    tree = select(models.Comment.id).where(models.Comment.id.in_(select(roots.c.id))).cte("comment_tree", recursive=True)
+    tree = tree.union_all(
+        select(models.Comment.id)
+        .join(tree, models.Comment.parent_id == tree.c.id)
+        .where(models.Comment.status == "approved")
+    )
+    comments = db.query(models.Comment).join(tree, models.Comment.id == tree.c.id).all()
+
+    # Built from columns only: validating against CommentThread would lazy-load `replies`
+    nodes = {
+        comment.id: {**schemas.Comment.model_validate(comment).model_dump(), "parent_id": comment.parent_id, "replies": []}
+        for comment in comments
+    }
+    top = []
+    for comment in sorted(comments, key=lambda c: (c.created_at, c.id)):
+        node = nodes[comment.id]
+        if comment.parent_id is None:
+            top.append((comment, node))
+        elif comment.parent_id in nodes:
+            nodes[comment.parent_id]["replies"].append(node)
+    top.sort(key=lambda item: (item[0].created_at, item[0].id), reverse=True)
+    page = time_page([comment for comment, _ in top], limit)
+    return {"items": [node for _, node in top[:limit]], "next_cursor": page["next_cursor"]}
 
 def create_comment(db: Session, comment: schemas.CommentCreate, post_id: str):
+    data = comment.dict()
+    if data["parent_id"] is not None:
+        data["parent_id"] = str(data["parent_id"])
     db_comment = models.Comment(
-        **comment.dict(),
+        **data,
         post_id=post_id
     )
     db.add(db_comment)
     db.commit()
+    invalidate(f"comments:{post_id}")
     db.refresh(db_comment)
     return db_comment
 
@@ -122,36 +336,108 @@ def update_comment_status(db: Session, comment_id: str, status: str):
     if db_comment:
         db_comment.status = status
         db.commit()
+        invalidate(f"comments:{db_comment.post_id}")
         db.refresh(db_comment)
     return db_comment
 
 def delete_comment(db: Session, comment_id: str):
     db_comment = db.query(models.Comment).filter(models.Comment.id == comment_id).first()
     if db_comment:
+        post_id = db_comment.post_id
         db.delete(db_comment)
         db.commit()
+        invalidate(f"comments:{post_id}")
     return True
 
+def get_comments_by_status(db: Session, status: str = "pending", limit: int = 50, cursor: Optional[str] = None):
+    query = db.query(models.Comment).filter(models.Comment.status == status)
+    query = after_time_cursor(query, models.Comment, cursor)
+    return time_page(query.limit(limit + 1).all(), limit)
+
+MODERATION_STATUS = {"approve": "approved", "reject": "rejected"}
+
+def moderate_comments(db: Session, moderation: schemas.CommentModeration) -> Optional[int]:
+    """
+    Approve, reject or delete every matching comment with one set-based statement.
+
+    Returns the number of rows affected, or None when neither ids nor any
+    filter was given (a bulk action never applies to every comment).
+    Bulk deletes skip ORM cascades; replies of a deleted comment are removed
+    by the foreign key where it is enforced and are no longer reachable in
+    comment threads otherwise.
+    """
+    conditions = []
+    if moderation.ids is not None:
+        conditions.append(models.Comment.id.in_([str(i) for i in moderation.ids]))
+    if moderation.post_id is not None:
+        conditions.append(models.Comment.post_id == str(moderation.post_id))
+    if moderation.author_email is not None:
+        conditions.append(models.Comment.author_email == moderation.author_email)
+    if moderation.created_before is not None:
+        conditions.append(models.Comment.created_at < moderation.created_before)
+    if moderation.status is not None:
+        conditions.append(models.Comment.status == moderation.status)
+    if not conditions:
+        return None
+
+    post_ids = [row[0] for row in db.query(models.Comment.post_id).filter(*conditions).distinct()]
+    query = db.query(models.Comment).filter(*conditions)
+    if moderation.action == "delete":
+        affected = query.delete(synchronize_session=False)
+    else:
+        affected = query.update({models.Comment.status: MODERATION_STATUS[moderation.action]}, synchronize_session=False)
+    db.commit()
+    invalidate(*(f"comments:{post_id}" for post_id in post_ids))
+    return affected
+
 # ==================== RATING CRUD ====================
 
 def create_rating(db: Session, rating: schemas.RatingCreate, post_id: str):
+    """
+    Record a vote and fold it into the post's rating_sum/rating_count.
+
+    Returns None when this address already rated the post (enforced by the
+    unique index, so concurrent duplicates are rejected too).
+    """
     db_rating = models.Rating(
         **rating.dict(),
         post_id=post_id
     )
-    db.add(db_rating)
+    try:
+        with db.begin_nested():
+            db.add(db_rating)
+    except IntegrityError:
+        return None
+    db.query(models.Post).filter(models.Post.id == post_id).update({
+        models.Post.rating_sum: models.Post.rating_sum + rating.rating,
+        models.Post.rating_count: models.Post.rating_count + 1,
+        models.Post.updated_at: models.Post.updated_at,
+    }, synchronize_session=False)
+    slug = db.query(models.Post.slug).filter(models.Post.id == post_id).scalar()
     db.commit()
     db.refresh(db_rating)
+    # Lists pick the new average up on expiry, like views_count
+    invalidate(f"post:{post_id}", f"post:{slug}")
     return db_rating
 
 def get_post_average_rating(db: Session, post_id: str):
-    avg = db.query(func.avg(models.Rating.rating)).filter(
-        models.Rating.post_id == post_id
-    ).scalar()
-    count = db.query(func.count(models.Rating.id)).filter(
-        models.Rating.post_id == post_id
-    ).scalar()
-    return {"average": float(avg) if avg else 0, "count": count}
+    row = db.query(models.Post.rating_sum, models.Post.rating_count).filter(
+        models.Post.id == post_id
+    ).first()
+    if row is None or not row.rating_count:
+        return {"average": 0, "count": 0}
+    return {"average": round(row.rating_sum / row.rating_count, 2), "count": row.rating_count}
+
+def recount_ratings(db: Session):
+    """Recompute the maintained rating aggregates from the ratings table"""
+    of_post = models.Rating.post_id == models.Post.id
+    db.execute(update(models.Post).values(
+        rating_sum=select(func.coalesce(func.sum(models.Rating.rating), 0)).where(of_post).scalar_subquery(),
+        rating_count=select(func.count(models.Rating.id)).where(of_post).scalar_subquery(),
+        updated_at=models.Post.updated_at,
+    ))
+    db.commit()
+    invalidate("posts")
 
 # ==================== CATEGORY CRUD ====================
 
@@ -162,6 +448,7 @@ def create_category(db: Session, category: schemas.CategoryCreate):
     db_category = models.Category(**category.dict())
     db.add(db_category)
     db.commit()
+    invalidate("categories")
     db.refresh(db_category)
     return db_category
 
@@ -171,6 +458,7 @@ def update_category(db: Session, category_id: str, category: schemas.CategoryCre
         for key, value in category.dict().items():
             setattr(db_category, key, value)
         db.commit()
+        invalidate("categories", "posts")
         db.refresh(db_category)
     return db_category
 
@@ -179,6 +467,7 @@ def delete_category(db: Session, category_id: str):
     if db_category:
         db.delete(db_category)
         db.commit()
+        invalidate("categories", "posts")
     return True
 
 # ==================== TAG CRUD ====================
@@ -186,17 +475,43 @@ def delete_category(db: Session, category_id: str):
 def get_tags(db: Session):
     return db.query(models.Tag).all()
 
+def get_taxonomy_counts(db: Session):
+    return {
+        "categories": dict(db.query(models.Category.slug, models.Category.post_count).all()),
+        "tags": dict(db.query(models.Tag.slug, models.Tag.post_count).all())
+    }
+
+def recount_taxonomy(db: Session):
+    """Recompute the maintained post counters from the association tables"""
+    for model, table, key in (
+        (models.Category, models.post_categories, "category_id"),
+        (models.Tag, models.post_tags, "tag_id"),
+    ):
+        published = (
+            select(func.count())
+            .select_from(table.join(models.Post, models.Post.id == table.c.post_id))
+            .where(table.c[key] == model.id, models.Post.status == "published")
+            .scalar_subquery()
+        )
+        db.execute(update(model).values(post_count=published))
+    db.commit()
+    invalidate("categories", "tags")
+
 def create_tag(db: Session, tag: schemas.TagCreate):
     db_tag = models.Tag(**tag.dict())
     db.add(db_tag)
     db.commit()
+    invalidate("tags")
     db.refresh(db_tag)
     return db_tag
 
 # ==================== MEDIA CRUD ====================
 
-def get_media(db: Session, skip: int = 0, limit: int = 50):
-    return db.query(models.Media).offset(skip).limit(limit).all()
+def get_media(db: Session, skip: int = 0, limit: int = 50, cursor: Optional[str] = None):
+    query = after_time_cursor(db.query(models.Media), models.Media, cursor)
+    if skip and not cursor:
+        query = query.offset(skip)
+    return time_page(query.limit(limit + 1).all(), limit)
 
 def create_media(db: Session, media: schemas.MediaCreate, user_id: str):
     db_media = models.Media(
@@ -224,29 +539,83 @@ def create_page_view(db: Session, view: schemas.PageViewCreate):
     db.refresh(db_view)
     return db_view
 
-def get_post_analytics(db: Session, post_id: str):
-    views = db.query(func.count(models.PageView.id)).filter(
-        models.PageView.post_id == post_id
-    ).scalar()
-    
+def bulk_create_page_views(db: Session, views: List[dict]):
+    # executemany INSERT (batched into multi-row VALUES by the psycopg2 dialect), one commit
+    db.execute(insert(models.PageView), views)
+    db.commit()
+
+ANALYTICS_DEFAULT_DAYS = 30
+
+def analytics_range(start: Optional[date] = None, end: Optional[date] = None):
+    end = end or datetime.utcnow().date()
+    start = start or end - timedelta(days=ANALYTICS_DEFAULT_DAYS - 1)
+    return start, end
+
+def _rollup_source(granularity: str, start: date, end: date):
+    # Rollup table, its bucket column and the half-open range covering [start, end]
+    if granularity == "hour":
+        model = models.PageViewHourly
+        return model, model.bucket, datetime.combine(start, time.min), datetime.combine(end + timedelta(days=1), time.min)
+    model = models.PageViewDaily
+    return model, model.day, start, end + timedelta(days=1)
+
+def get_post_analytics(
+    db: Session,
+    post_id: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    granularity: str = "day"
+):
+    start, end = analytics_range(start, end)
+    model, bucket, lower, upper = _rollup_source(granularity, start, end)
+    views = func.sum(model.views)
+
+    def breakdown(column, limit=None):
+        query = db.query(column, views).filter(
+            model.post_id == post_id, bucket >= lower, bucket < upper
+        ).group_by(column)
+        if limit:
+            query = query.order_by(views.desc()).limit(limit)
+        else:
+            query = query.order_by(column)
+        return query.all()
+
+    series = breakdown(bucket)
     return {
-        "total_views": views,
-        "post_id": post_id
+        "post_id": post_id,
+        "start": start,
+        "end": end,
+        "granularity": granularity,
+        "total_views": sum(n for _, n in series),
+        "series": [{"bucket": b, "views": n} for b, n in series],
+        "referrers": [{"referrer": r or "direct", "views": n} for r, n in breakdown(model.referrer, 10)],
+        "countries": [{"country": c or None, "views": n} for c, n in breakdown(model.country, 10)],
     }
 
 def count_posts(db: Session):
     return db.query(func.count(models.Post.id)).scalar()
 
-def count_total_views(db: Session):
-    return db.query(func.sum(models.Post.views_count)).scalar() or 0
+def count_total_views(db: Session, start: Optional[date] = None, end: Optional[date] = None):
+    start, end = analytics_range(start, end)
+    return db.query(func.sum(models.PageViewDaily.views)).filter(
+        models.PageViewDaily.day >= start,
+        models.PageViewDaily.day <= end
+    ).scalar() or 0
 
 def count_comments(db: Session):
     return db.query(func.count(models.Comment.id)).scalar()
 
-def get_popular_posts(db: Session, limit: int = 10):
-    return db.query(models.Post).order_by(
-        models.Post.views_count.desc()
-    ).limit(limit).all()
+def get_popular_posts(db: Session, limit: int = 10, start: Optional[date] = None, end: Optional[date] = None):
+    start, end = analytics_range(start, end)
+    views = func.sum(models.PageViewDaily.views).label("views")
+    top = db.query(models.PageViewDaily.post_id, views).filter(
+        models.PageViewDaily.day >= start,
+        models.PageViewDaily.day <= end
+    ).group_by(models.PageViewDaily.post_id).order_by(views.desc()).limit(limit).subquery()
+    rows = db.query(models.Post.id, models.Post.slug, models.Post.title, top.c.views).join(
+        top, top.c.post_id == models.Post.id
+    ).order_by(top.c.views.desc()).all()
+    return [{"id": i, "slug": slug, "title": title, "views": n} for i, slug, title, n in rows]
 
 def get_recent_comments(db: Session, limit: int = 10):
     return db.query(models.Comment).order_by(
@@ -255,12 +624,97 @@ def get_recent_comments(db: Session, limit: int = 10):
 
 # ==================== SEARCH ====================
 
-def search_posts(db: Session, query: str, skip: int = 0, limit: int = 20):
-    return db.query(models.Post).filter(
-        or_(
-            models.Post.title.contains(query),
-            models.Post.content.contains(query),
-            models.Post.excerpt.contains(query)
-        ),
-        models.Post.status == "published"
-    ).offset(skip).limit(limit).all()
+def search_posts(db: Session, query: str, skip: int = 0, limit: int = 20, cursor: Optional[str] = None):
+    ranked = search_index.cached_rank(db, query)
+    if cursor:
+        score, last_id = decode_cursor(cursor, 2)
+        if not isinstance(score, (int, float)) or not isinstance(last_id, str):
+            raise InvalidCursor("Invalid cursor")
+        remaining = [item for item in ranked if (-item[1], item[0]) > (-score, last_id)]
+    else:
+        remaining = ranked[skip:]
+    page = remaining[:limit]
+    page_ids = [post_id for post_id, _ in page]
+    posts = {
+        row.id: row
+        for row in db.query(*POST_SUMMARY_COLUMNS).filter(
+            models.Post.id.in_(page_ids),
+            models.Post.status == "published"
+        ).all()
+    }
+    return {
+        "total": len(ranked),
+        "results": [summary_dict(posts[post_id]) for post_id in page_ids if post_id in posts],
+        "next_cursor": encode_cursor(page[-1][1], page[-1][0]) if len(remaining) > limit else None
+    }
+
+# ==================== ASYNC READS ====================
+
+# Async endpoints reuse the query code above through run_sync() - inside the
+# async engine's greenlet, or in the threadpool when it is disabled (see
+# database.get_async_db). Results are validated into their response schema
+# in there, so nothing lazy-loads once control is back on the event loop.
+
+@lru_cache(maxsize=None)
+def _adapter(response_type) -> TypeAdapter:
+    return TypeAdapter(response_type)
+
+async def run_read(db, response_type, fn, /, *args, **kwargs):
+    adapter = _adapter(response_type)
+
+    def read(session: Session):
+        return adapter.validate_python(fn(session, *args, **kwargs), from_attributes=True)
+
+    return await db.run_sync(read)
+
+async def get_posts_async(db, **filters) -> dict:
+    # Listing rows are plain dicts already (see get_post_cards)
+    return await db.run_sync(get_post_cards, **filters)
+
+async def get_post_detail_async(db, slug: str) -> Optional[schemas.PostDetail]:
+    return await run_read(db, Optional[schemas.PostDetail], get_post_by_slug, slug=slug, schema=schemas.PostDetail)
+
+# Serialized PostDetail bodies of published posts. Keys carry the versions of
+# every tag a post write, rating or taxonomy rename bumps; the TTL bounds how
+# stale the embedded views_count can get.
+POST_PAYLOAD_CACHE_SIZE = int(os.getenv("POST_PAYLOAD_CACHE_SIZE", "2048"))
+POST_PAYLOAD_TTL = float(os.getenv("POST_PAYLOAD_TTL", "300"))
+post_payloads = ResponseCache(MemoryBackend(POST_PAYLOAD_CACHE_SIZE), ttl=POST_PAYLOAD_TTL)
+
+async def get_post_payload_async(db, slug: str, route: str = "primary") -> Optional[CacheEntry]:
+    """
+    PostDetail JSON bytes for a slug (meta carries post_id), from post_payloads when possible.
+
+    `route` is how the read session was chosen (database.read_route): a
+    client pinned to the primary skips the cache, and a payload read from a
+    replica is not stored while the post's tags were just bumped.
+    """
+    tags = ["posts", f"post:{slug}", "categories", "tags"]
+    key = post_payloads.key("post", slug, tags)
+    entry = post_payloads.get(key) if route != "pinned" else None
+    if entry is not None:
+        return entry
+    post = await get_post_detail_async(db, slug=slug)
+    if post is None:
+        return None
+    entry = CacheEntry(_adapter(schemas.PostDetail).dump_json(post), [], {"post_id": str(post.id)})
+    if post.status == "published" and not (route == "replica" and recently_bumped(tags)):
+        post_payloads.set(key, entry)
+    return entry
+
+async def get_comment_threads_async(db, post_id: str, limit: int = 20,
+                                    cursor: Optional[str] = None) -> schemas.CommentThreadPage:
+    return await run_read(db, schemas.CommentThreadPage, get_comment_threads, post_id=post_id, limit=limit, cursor=cursor)
+
+async def get_categories_async(db) -> List[schemas.Category]:
+    return await run_read(db, List[schemas.Category], get_categories)
+
+async def get_tags_async(db) -> List[schemas.Tag]:
+    return await run_read(db, List[schemas.Tag], get_tags)
+
+async def get_taxonomy_counts_async(db) -> schemas.TaxonomyCounts:
+    return await run_read(db, schemas.TaxonomyCounts, get_taxonomy_counts)
+
+async def search_posts_async(db, query: str, skip: int = 0, limit: int = 20,
+                             cursor: Optional[str] = None) -> dict:
+    return await db.run_sync(search_posts, query=query, skip=skip, limit=limit, cursor=cursor)
@@ -1,27 +1,329 @@
 """Database configuration and session management"""
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from fastapi import Request
+from itertools import count
+import hashlib
 import os
+import threading
+import time
 from dotenv import load_dotenv
 
+from .cache import READ_YOUR_WRITES_SECONDS, shared_cache
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./blog.db")
+# Comma-separated read replicas for the read endpoints (empty: read from DATABASE_URL)
+DATABASE_READ_URLS = [url.strip() for url in os.getenv("DATABASE_READ_URLS", "").split(",") if url.strip()]
+# Headers the proxy in front of the API (Railway, Render, a CDN) uses to pass
+# the visitor's address; the first present wins, and the first address in a
+# comma-separated chain is the original client
+CLIENT_ADDRESS_HEADERS = [h.strip().lower() for h in os.getenv(
+    "CLIENT_ADDRESS_HEADERS", "cf-connecting-ip,x-forwarded-for,x-real-ip"
+).split(",") if h.strip()]
+
+# Connection pool (ignored for in-memory SQLite, which uses a single connection)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+# SQLite tuning, applied to every new connection
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+
+class PoolWaitStats:
+    """How long checkouts waited for a pooled connection"""
+
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3),
+            }
+
+
+def _timed_pool(base):
+    # Pool subclass that times each checkout; a pool recreated on dispose()
+    # is built from the same class and keeps counting into the same stats
+    class TimedPool(base):
+        wait_stats = PoolWaitStats()
+
+        def _do_get(self):
+            start = time.perf_counter()
+            try:
+                conn = super()._do_get()
+            except Exception:
+                self.wait_stats.record(time.perf_counter() - start, timed_out=True)
+                raise
+            self.wait_stats.record(time.perf_counter() - start)
+            return conn
+
+    TimedPool.__name__ = f"Timed{base.__name__}"
+    return TimedPool
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.split("://", 1)[1] in ("", "/"))
+
+def engine_options(url: str, pool_class=QueuePool) -> dict:
+    """create_engine() keyword arguments for a database URL"""
+    options = {}
+    if _is_sqlite(url):
+        options["connect_args"] = {"check_same_thread": False}
+        if _is_memory_sqlite(url):
+            return options
+    return {
+        **options,
+        "poolclass": _timed_pool(pool_class),
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
 
-# SQLite specific configuration
-if DATABASE_URL.startswith("sqlite"):
-    engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
-else:
-    engine = create_engine(DATABASE_URL)
+def tune_sqlite(engine):
+    """
+    Per-connection SQLite settings for concurrent writers.
+
+    WAL lets readers run alongside the single writer, busy_timeout makes a
+    writer wait for the lock instead of failing with "database is locked",
+    and synchronous=NORMAL is durable under WAL at a fraction of the fsyncs.
+    """
+    @event.listens_for(engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA journal_mode = WAL")
+        cursor.execute(f"PRAGMA synchronous = {SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+        cursor.close()
+
+def pool_status(engine) -> dict:
+    """Checked-out / overflow counts and checkout wait times for an engine's pool"""
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": DB_MAX_OVERFLOW,
+        })
+    stats = getattr(pool, "wait_stats", None)
+    if stats is not None:
+        status.update(stats.snapshot())
+    return status
+
+def make_engine(url: str):
+    engine = create_engine(url, **engine_options(url))
+    if _is_sqlite(url) and not _is_memory_sqlite(url):
+        tune_sqlite(engine)
+    return engine
+
+engine = make_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+read_engines = [make_engine(url) for url in DATABASE_READ_URLS]
+ReadSessionLocals = [sessionmaker(autocommit=False, autoflush=False, bind=e) for e in read_engines]
+
 Base = declarative_base()
 
-def get_db():
+# ==================== READ-YOUR-WRITES ====================
+
+def client_address(request: Request) -> str:
+    """
+    The visitor's address as reported by the proxy, else the peer address.
+
+    Behind a proxy every peer address is the proxy's own, which would make one
+    anonymous write pin every anonymous reader to the primary. The headers are
+    client-controlled, but a forged one only moves that client's reads.
+    """
+    for name in CLIENT_ADDRESS_HEADERS:
+        value = request.headers.get(name, "").split(",")[0].strip()
+        if value:
+            return value
+    return request.client.host if request.client else ""
+
+def client_key(request: Request) -> str:
+    """Identify a client by its bearer token, or by address for anonymous requests"""
+    address = client_address(request)
+    identity = request.headers.get("authorization") or (address and "addr:" + address)
+    if not identity:
+        return ""  # unknown: pinning it would pin every such client together
+    return "primary:" + hashlib.sha256(identity.encode()).hexdigest()[:32]
+
+# Request scope keys: the pin lookup (done once per request) and where the
+# read session came from - "primary" (no replicas), "pinned" or "replica"
+PINNED_SCOPE_KEY = "db.pinned"
+READ_ROUTE_SCOPE_KEY = "db.read_route"
+
+def is_pinned(request: Request) -> bool:
+    """Whether the client committed a write in the last READ_YOUR_WRITES_SECONDS (with replicas configured)"""
+    if not DATABASE_READ_URLS:
+        return False
+    if PINNED_SCOPE_KEY not in request.scope:
+        key = client_key(request)
+        request.scope[PINNED_SCOPE_KEY] = bool(key) and shared_cache.get(key) is not None
+    return request.scope[PINNED_SCOPE_KEY]
+
+def read_route(request: Request) -> str:
+    return request.scope.get(READ_ROUTE_SCOPE_KEY, "primary")
+
+def _reads_from_primary(request: Request) -> bool:
+    if not DATABASE_READ_URLS:
+        route = "primary"
+    else:
+        route = "pinned" if is_pinned(request) else "replica"
+    request.scope[READ_ROUTE_SCOPE_KEY] = route
+    return route != "replica"
+
+@event.listens_for(SessionLocal, "after_commit")
+def _pin_to_primary(session):
+    # A client that just wrote reads from the primary until replicas catch up
+    key = session.info.get("client_key")
+    if key:
+        shared_cache.set(key, b"1", READ_YOUR_WRITES_SECONDS)
+
+_replica_counter = count()
+
+def _next_replica(factories: list):
+    return factories[next(_replica_counter) % len(factories)]
+
+def get_db(request: Request = None):
     db = SessionLocal()
+    if request is not None and DATABASE_READ_URLS:
+        db.info["client_key"] = client_key(request)
+    try:
+        yield db
+    finally:
+        db.close()
+
+def get_read_db(request: Request):
+    """
+    Read-only session, round-robin across DATABASE_READ_URLS.
+
+    Clients that committed a write in the last READ_YOUR_WRITES_SECONDS
+    (tracked in the shared cache, so across workers) get the primary.
+    """
+    if _reads_from_primary(request):
+        yield from get_db()
+        return
+    db = _next_replica(ReadSessionLocals)()
     try:
         yield db
     finally:
         db.close()
+
+# ==================== ASYNC ====================
+
+# Serve the async read endpoints from an async engine (aiosqlite / asyncpg)
+# instead of running their sync queries in the threadpool
+ASYNC_DATABASE = os.getenv("ASYNC_DATABASE", "false").lower() == "true"
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+def async_database_url(url: str) -> str:
+    """Swap the sync driver in a database URL for its async counterpart"""
+    scheme, rest = url.split("://", 1)
+    backend = scheme.split("+", 1)[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for {scheme}:// URLs")
+    return f"{ASYNC_DRIVERS[backend]}://{rest}"
+
+async_engine = None
+AsyncSessionLocal = None
+AsyncReadSessionLocals = []
+if ASYNC_DATABASE:
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    def make_async_engine(url: str):
+        engine = create_async_engine(async_database_url(url), **engine_options(url, AsyncAdaptedQueuePool))
+        if _is_sqlite(url) and not _is_memory_sqlite(url):
+            tune_sqlite(engine.sync_engine)
+        return engine
+
+    async_engine = make_async_engine(DATABASE_URL)
+    AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+    AsyncReadSessionLocals = [
+        async_sessionmaker(make_async_engine(url), autoflush=False, expire_on_commit=False)
+        for url in DATABASE_READ_URLS
+    ]
+
+
+class ThreadpoolSession:
+    """
+    A sync Session behind AsyncSession.run_sync()'s interface.
+
+    Lets async endpoints call the same crud functions whether or not the
+    async engine is enabled; without it each call runs in the threadpool.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    async def run_sync(self, fn, *args, **kwargs):
+        from starlette.concurrency import run_in_threadpool
+
+        return await run_in_threadpool(fn, self.session, *args, **kwargs)
+
+
+async def _async_session(async_factory, sync_factory):
+    if async_factory is not None:
+        async with async_factory() as db:
+            yield db
+        return
+    db = sync_factory()
+    try:
+        yield ThreadpoolSession(db)
+    finally:
+        db.close()
+
+async def get_async_db():
+    """AsyncSession when ASYNC_DATABASE is set, otherwise a threadpool-backed sync session"""
+    async for db in _async_session(AsyncSessionLocal, SessionLocal):
+        yield db
+
+async def get_async_read_db(request: Request):
+    """get_async_db() for read endpoints, routed like get_read_db()"""
+    if _reads_from_primary(request):
+        async_factory, sync_factory = AsyncSessionLocal, SessionLocal
+    else:
+        replica = next(_replica_counter) % len(DATABASE_READ_URLS)
+        async_factory = AsyncReadSessionLocals[replica] if AsyncReadSessionLocals else None
+        sync_factory = ReadSessionLocals[replica]
+    async for db in _async_session(async_factory, sync_factory):
+        yield db
@@ -0,0 +1,185 @@
+"""
+Static site export
+Writes published posts as static HTML/JSON plus index pages, rebuilding only what changed
+
+    python -m app.export ./public [--full] [--workers N]
+"""
+
+import argparse
+import html
+import json
+import os
+import shutil
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List
+
+from sqlalchemy.orm import Session
+
+from . import crud, models, rendering, schemas
+
+MANIFEST_NAME = "manifest.json"
+EXPORT_BATCH = 200
+INDEX_PAGE_SIZE = int(os.getenv("EXPORT_INDEX_PAGE_SIZE", "20"))
+EXPORT_WORKERS = int(os.getenv("EXPORT_WORKERS", str(os.cpu_count() or 1)))
+
+PAGE_TEMPLATE = """<!doctype html>
+<html lang="he" dir="rtl">
+<head>
+<meta charset="utf-8">
+<meta name="viewport" content="width=device-width, initial-scale=1">
+<title>{title}</title>
+<meta name="description" content="{description}">
+</head>
+<body>
+{body}
+</body>
+</html>
+"""
+
+
+def _file_name(slug: str) -> str:
+    # Slugs are used as file names; keep them inside their directory
+    return slug.replace("/", "%2F").lstrip(".") or "_"
+
+def _write(path: str, content: str):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(tmp, path)  # readers never see a half-written file
+
+def _updated_key(post) -> str:
+    stamp = post.updated_at or post.created_at
+    return stamp.isoformat() if stamp else ""
+
+# ==================== WORKERS ====================
+
+def export_post(out_dir: str, payload: dict, content_html: str) -> str:
+    """Write posts/<slug>.json and posts/<slug>.html for one post (runs in the process pool)"""
+    if content_html is None:  # not rendered yet, or by an older renderer version
+        content_html = rendering.render_markdown(payload["content"])
+    name = _file_name(payload["slug"])
+    _write(os.path.join(out_dir, "posts", f"{name}.json"), json.dumps(payload, ensure_ascii=False))
+    body = f"<article>\n<h1 dir=\"auto\">{html.escape(payload['title'])}</h1>\n{content_html}\n</article>"
+    _write(os.path.join(out_dir, "posts", f"{name}.html"), PAGE_TEMPLATE.format(
+        title=html.escape(payload["title"]),
+        description=html.escape(payload.get("excerpt") or "", quote=True),
+        body=body,
+    ))
+    return payload["slug"]
+
+# ==================== PIPELINE ====================
+
+def _published(db: Session):
+    """Every published post, newest first, streamed in keyset-paged batches"""
+    cursor = None
+    while True:
+        page = crud.get_posts(db, limit=EXPORT_BATCH, status="published", cursor=cursor)
+        yield from page["items"]
+        cursor = page["next_cursor"]
+        if not cursor:
+            return
+
+def _load_details(db: Session, post_ids: List[str]):
+    for i in range(0, len(post_ids), EXPORT_BATCH):
+        chunk = post_ids[i:i + EXPORT_BATCH]
+        yield from crud.post_query(db, schemas.PostDetail).filter(models.Post.id.in_(chunk)).all()
+
+def _write_indexes(out_dir: str, summaries: List[dict]):
+    pages = [summaries[i:i + INDEX_PAGE_SIZE] for i in range(0, len(summaries), INDEX_PAGE_SIZE)] or [[]]
+    for number, items in enumerate(pages, start=1):
+        base = "index" if number == 1 else os.path.join("page", str(number))
+        next_page = f"page/{number + 1}" if number < len(pages) else None
+        _write(os.path.join(out_dir, f"{base}.json"), json.dumps(
+            {"items": items, "next_page": next_page}, ensure_ascii=False
+        ))
+        links = "\n".join(
+            f'<li><a href="/posts/{html.escape(_file_name(item["slug"]), quote=True)}.html" dir="auto">'
+            f'{html.escape(item["title"])}</a></li>'
+            for item in items
+        )
+        nav = f'<nav><a href="/{next_page}.html">הבא</a></nav>' if next_page else ""
+        _write(os.path.join(out_dir, f"{base}.html"), PAGE_TEMPLATE.format(
+            title="פוסטים", description="", body=f"<ul>\n{links}\n</ul>\n{nav}"
+        ))
+    # Index pages past the new last one are stale
+    number = len(pages) + 1
+    while os.path.exists(os.path.join(out_dir, "page", f"{number}.html")):
+        for ext in ("html", "json"):
+            os.remove(os.path.join(out_dir, "page", f"{number}.{ext}"))
+        number += 1
+
+def export_site(db: Session, out_dir: str, full: bool = False, workers: int = EXPORT_WORKERS) -> Dict[str, int]:
+    """
+    Export published posts to out_dir.
+
+    The manifest maps post ids to the slug and updated_at they were last
+    exported with; only new or changed posts are rebuilt (everything with
+    `full` or after a renderer change), and posts no longer published have
+    their files removed. Index pages are rewritten on every run.
+    """
+    manifest_path = os.path.join(out_dir, MANIFEST_NAME)
+    manifest = {}
+    if not full and os.path.exists(manifest_path):
+        with open(manifest_path, encoding="utf-8") as f:
+            manifest = json.load(f)
+    if manifest.get("renderer") != rendering.RENDERER_VERSION:
+        manifest = {}
+    previous = manifest.get("posts", {})
+
+    summaries, current, changed = [], {}, []
+    for post in _published(db):
+        summaries.append(schemas.PostSummary.model_validate(post).model_dump(mode="json"))
+        current[post.id] = {"slug": post.slug, "updated_at": _updated_key(post)}
+        if previous.get(post.id) != current[post.id]:
+            changed.append(post.id)
+
+    # At most EXPORT_BATCH posts are in flight (loaded, pickled or being
+    # written), so a full rebuild does not hold the archive in memory
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        in_flight = deque()
+        for post in _load_details(db, changed):
+            in_flight.append(pool.submit(
+                export_post,
+                out_dir,
+                schemas.PostDetail.model_validate(post).model_dump(mode="json"),
+                post.content_html if rendering.is_current(post) else None,
+            ))
+            if len(in_flight) >= EXPORT_BATCH:
+                in_flight.popleft().result()
+        while in_flight:
+            in_flight.popleft().result()
+
+    removed = 0
+    live = {entry["slug"] for entry in current.values()}
+    for post_id, entry in previous.items():
+        if entry["slug"] not in live:
+            for ext in ("html", "json"):
+                path = os.path.join(out_dir, "posts", f"{_file_name(entry['slug'])}.{ext}")
+                if os.path.exists(path):
+                    os.remove(path)
+            removed += 1
+
+    _write_indexes(out_dir, summaries)
+    _write(manifest_path, json.dumps({"renderer": rendering.RENDERER_VERSION, "posts": current}, ensure_ascii=False))
+    return {"published": len(current), "rebuilt": len(changed), "removed": removed}
+
+
+if __name__ == "__main__":
+    from .database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Export published posts as a static site")
+    parser.add_argument("out_dir")
+    parser.add_argument("--full", action="store_true", help="ignore the manifest and rebuild every post")
+    parser.add_argument("--workers", type=int, default=EXPORT_WORKERS)
+    args = parser.parse_args()
+
+    if args.full and os.path.isdir(os.path.join(args.out_dir, "posts")):
+        shutil.rmtree(os.path.join(args.out_dir, "posts"))
+    session = SessionLocal()
+    try:
+        stats = export_site(session, args.out_dir, full=args.full, workers=args.workers)
+        print(f"✅ Exported {stats['published']} posts ({stats['rebuilt']} rebuilt, {stats['removed']} removed)")
+    finally:
+        session.close()
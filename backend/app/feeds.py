@@ -0,0 +1,190 @@
+"""
+RSS feed and sitemap
+Streamed from a column-projected server-side cursor and cached per published-posts state
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Iterator, Optional
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import MemoryBackend, tag_versions
+from .database import SessionLocal
+
+SITE_URL = os.getenv("SITE_URL", "http://localhost:3000").rstrip("/")
+SITE_TITLE = os.getenv("SITE_TITLE", "Hebrew Markdown Blog")
+RSS_ITEMS = int(os.getenv("RSS_ITEMS", "50"))
+SITEMAP_MAX_URLS = 50000  # per sitemap file, as the protocol allows
+FEED_CURSOR_BATCH = 1000
+# States and documents are dropped after this long even if the "posts" tag
+# never moves here - it is only bumped in the worker that made the change
+FEED_CACHE_TTL = float(os.getenv("FEED_CACHE_TTL", "60"))
+
+# Whole documents, keyed by the state they were generated from
+feed_cache = MemoryBackend(max_entries=256)
+
+FEED_COLUMNS = (
+    models.Post.slug,
+    models.Post.title,
+    models.Post.excerpt,
+    models.Post.published_at,
+    models.Post.created_at,
+    models.Post.updated_at,
+)
+
+
+class FeedState:
+    """Count and newest change of the published posts - identifies a feed version"""
+
+    def __init__(self, count: int, last_modified: Optional[datetime]):
+        self.count = count
+        self.last_modified = last_modified
+
+    def etag(self, document: str) -> str:
+        stamp = self.last_modified.isoformat() if self.last_modified else ""
+        digest = hashlib.sha256(f"{document}|{self.count}|{stamp}".encode()).hexdigest()[:32]
+        return f'"{digest}"'
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # SQLite hands timestamps back naive; they are stored in UTC
+    if value is not None and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+def feed_state(db: Session) -> FeedState:
+    """
+    Current FeedState, computed once per version of the "posts" cache tag.
+
+    Every post create/update/delete bumps that tag, so crawlers polling an
+    unchanged feed cost no queries at all; FEED_CACHE_TTL bounds how long
+    other workers' changes go unseen.
+    """
+    key = f"feedstate#{tag_versions(['posts'])}"
+    cached = feed_cache.get(key)
+    if cached is not None:
+        count, stamp = json.loads(cached)
+        return FeedState(count, datetime.fromisoformat(stamp) if stamp else None)
+    count, last_modified = db.query(
+        func.count(models.Post.id),
+        func.max(func.coalesce(models.Post.updated_at, models.Post.published_at, models.Post.created_at))
+    ).filter(models.Post.status == "published").one()
+    if isinstance(last_modified, str):  # SQLite returns the aggregate as text
+        last_modified = datetime.fromisoformat(last_modified)
+    last_modified = _utc(last_modified)
+    feed_cache.set(key, json.dumps([count, last_modified.isoformat() if last_modified else None]).encode(), FEED_CACHE_TTL)
+    return FeedState(count, last_modified)
+
+def _rows(order_newest: bool, offset: int = 0, limit: Optional[int] = None):
+    """Projected published-post rows over a server-side cursor, on a session of its own"""
+    db = SessionLocal()
+    try:
+        order = (models.Post.created_at.desc(), models.Post.id.desc()) if order_newest else (
+            models.Post.created_at, models.Post.id
+        )
+        query = db.query(*FEED_COLUMNS).filter(models.Post.status == "published").order_by(*order)
+        if offset:
+            query = query.offset(offset)
+        if limit is not None:
+            query = query.limit(limit)
+        yield from query.execution_options(stream_results=True, yield_per=FEED_CURSOR_BATCH)
+    finally:
+        db.close()
+
+def _post_url(slug: str) -> str:
+    return f"{SITE_URL}/posts/{quote(slug)}"
+
+def _lastmod(row) -> Optional[datetime]:
+    return _utc(row.updated_at or row.published_at or row.created_at)
+
+# ==================== DOCUMENTS ====================
+
+def rss_chunks() -> Iterator[str]:
+    yield (
+        '<?xml version="1.0" encoding="UTF-8"?>\n'
+        '<rss version="2.0"><channel>'
+        f"<title>{escape(SITE_TITLE)}</title><link>{escape(SITE_URL)}/</link>"
+        f"<description>{escape(SITE_TITLE)}</description><language>he</language>\n"
+    )
+    for row in _rows(order_newest=True, limit=RSS_ITEMS):
+        url = escape(_post_url(row.slug))
+        published = _utc(row.published_at or row.created_at)
+        yield (
+            f"<item><title>{escape(row.title)}</title><link>{url}</link>"
+            f'<guid isPermaLink="true">{url}</guid>'
+            + (f"<pubDate>{format_datetime(published)}</pubDate>" if published else "")
+            + (f"<description>{escape(row.excerpt)}</description>" if row.excerpt else "")
+            + "</item>\n"
+        )
+    yield "</channel></rss>\n"
+
+def sitemap_pages(state: FeedState) -> int:
+    return max(1, -(-state.count // SITEMAP_MAX_URLS))
+
+def sitemap_chunks(page: int = 1) -> Iterator[str]:
+    """URLs of one sitemap file (oldest posts first, so earlier files rarely change)"""
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    if page == 1:
+        yield f"<url><loc>{escape(SITE_URL)}/</loc></url>\n"
+    for row in _rows(order_newest=False, offset=(page - 1) * SITEMAP_MAX_URLS, limit=SITEMAP_MAX_URLS):
+        lastmod = _lastmod(row)
+        yield (
+            f"<url><loc>{escape(_post_url(row.slug))}</loc>"
+            + (f"<lastmod>{lastmod.strftime('%Y-%m-%dT%H:%M:%SZ')}</lastmod>" if lastmod else "")
+            + "</url>\n"
+        )
+    yield "</urlset>\n"
+
+def sitemap_index_chunks(state: FeedState, base_url: str) -> Iterator[str]:
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    for page in range(1, sitemap_pages(state) + 1):
+        yield f"<sitemap><loc>{escape(base_url)}/sitemap-{page}.xml</loc></sitemap>\n"
+    yield "</sitemapindex>\n"
+
+def cached_stream(key: str, chunks: Iterator[str]) -> Iterator[bytes]:
+    """
+    Serve a document from feed_cache, or stream it while filling the cache.
+
+    A client that disconnects midway leaves nothing cached.
+    """
+    cached = feed_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    parts = []
+    for chunk in chunks:
+        data = chunk.encode("utf-8")
+        parts.append(data)
+        yield data
+    feed_cache.set(key, b"".join(parts), FEED_CACHE_TTL)
+
+def feed_response(request: Request, state: FeedState, document: str, chunks: Iterator[str]) -> Response:
+    """Conditional (ETag / Last-Modified) streamed XML response"""
+    etag = state.etag(document)
+    headers = {"ETag": etag, "Cache-Control": "public, no-cache"}
+    last_modified = state.last_modified.replace(microsecond=0) if state.last_modified else None
+    if last_modified:
+        headers["Last-Modified"] = format_datetime(last_modified, usegmt=True)
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        if etag in [tag.strip() for tag in if_none_match.split(",")]:
+            return Response(status_code=304, headers=headers)
+    elif last_modified and request.headers.get("if-modified-since"):
+        try:
+            since = parsedate_to_datetime(request.headers["if-modified-since"])
+        except (TypeError, ValueError):
+            since = None
+        if since is not None and since.tzinfo is not None and last_modified <= since:
+            return Response(status_code=304, headers=headers)
+    return StreamingResponse(cached_stream(f"feed:{etag}", chunks), media_type="application/xml", headers=headers)
@@ -0,0 +1,163 @@
+"""
+Batched page view ingestion
+Tracking requests are queued in memory and a background writer bulk-inserts them
+"""
+
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Mapping
+
+from .database import SessionLocal
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+QUEUE_SIZE = int(os.getenv("PAGE_VIEW_QUEUE_SIZE", "10000"))
+BATCH_SIZE = int(os.getenv("PAGE_VIEW_BATCH_SIZE", "500"))
+FLUSH_INTERVAL_SECONDS = float(os.getenv("PAGE_VIEW_FLUSH_INTERVAL", "1"))
+# Request headers carrying the visitor's country, as set by the CDN/edge in
+# front of the API (Cloudflare, Vercel, CloudFront); the first present wins
+COUNTRY_HEADERS = [h.strip().lower() for h in os.getenv(
+    "COUNTRY_HEADERS", "cf-ipcountry,x-vercel-ip-country,cloudfront-viewer-country"
+).split(",") if h.strip()]
+
+
+def country_from_headers(headers: Mapping[str, str]) -> str:
+    """ISO 3166 alpha-2 code from the geo headers; "" when unknown"""
+    for name in COUNTRY_HEADERS:
+        value = (headers.get(name) or "").strip().upper()
+        if len(value) == 2 and value.isalpha() and value != "XX":  # XX: Cloudflare's "unknown"
+            return value
+    return ""
+
+
+class PageViewIngestor:
+    """
+    Bounded queue of page views drained by a single writer thread.
+
+    A batch is written as soon as it reaches `batch_size` rows or
+    `interval` seconds after its first row, whichever comes first. When the
+    queue is full, submit() refuses the view so callers can shed load
+    instead of growing memory without limit.
+    """
+
+    def __init__(self, max_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 interval: float = FLUSH_INTERVAL_SECONDS):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(maxsize=max_size)
+        self._stop = threading.Event()
+        self._thread = None
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "accepted": 0,
+            "rejected": 0,
+            "written": 0,
+            "failed": 0,
+            "batches": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+        }
+
+    def _bump(self, **deltas):
+        with self._stats_lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def submit(self, row: dict) -> bool:
+        """Queue a page view; returns False when the queue is full"""
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self._bump(rejected=1)
+            return False
+        self._bump(accepted=1)
+        return True
+
+    def _write(self, batch: List[dict]):
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            crud.bulk_create_page_views(db, batch)
+        except Exception:
+            logger.exception("Failed to write %d page views", len(batch))
+            db.rollback()
+            self._bump(failed=len(batch))
+            return
+        finally:
+            db.close()
+        with self._stats_lock:
+            self.stats["written"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_flush_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    def _next_batch(self) -> List[dict]:
+        try:
+            batch = [self._queue.get(timeout=self.interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _drain(self) -> List[dict]:
+        batch = []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write(batch)
+
+    def flush(self):
+        """Write everything currently queued"""
+        while True:
+            batch = self._drain()
+            if not batch:
+                return
+            self._write(batch)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="page-view-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the writer and flush the remaining queue"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def metrics(self) -> dict:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats.update({
+            "queue_depth": self._queue.qsize(),
+            "queue_capacity": self._queue.maxsize,
+            "batch_size": self.batch_size,
+            "flush_interval_seconds": self.interval,
+        })
+        return stats
+
+
+page_view_ingestor = PageViewIngestor()
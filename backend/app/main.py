@@ -3,28 +3,62 @@ Hebrew Markdown Blog - FastAPI Backend
 Main application file with all CRUD endpoints
 """
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, JSONResponse, ORJSONResponse, Response
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from contextlib import asynccontextmanager
 import os
 
-from .database import engine, get_db, Base
-from . import models, schemas, crud, auth
+from .database import async_engine, engine, get_async_read_db, get_db, get_read_db, pool_status, read_engines, read_route, Base
+from . import models, schemas, crud, auth, feeds, querycount
+from .pagination import InvalidCursor
+from .view_counter import view_counter
+from .ingest import country_from_headers, page_view_ingestor
+from .rollup import ensure_ingested_at, rollup_worker
+from .passwords import PasswordPoolBroken, PasswordPoolFull, password_pool
+from .response_cache import RESPONSE_CACHE_ENABLED, ResponseCacheMiddleware
 
 # Create tables
 Base.metadata.create_all(bind=engine)
+ensure_ingested_at(engine)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    view_counter.start()
+    page_view_ingestor.start()
+    rollup_worker.start()
+    yield
+    # Flush buffered view counts and queued page views on shutdown
+    rollup_worker.stop()
+    view_counter.stop()
+    page_view_ingestor.stop()
+    password_pool.shutdown()
 
 app = FastAPI(
     title="Hebrew Markdown Blog API",
     description="Advanced blog platform with Markdown, CMS, and analytics",
     version="1.0.0",
     docs_url="/api/docs",
-    redoc_url="/api/redoc"
+    redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+def _count_cached_view(path: str, entry):
+    # Cached post detail hits skip the endpoint, so the view is recorded here
+    post_id = entry.meta.get("post_id")
+    if post_id:
+        view_counter.record(post_id)
+
+# Response cache for public reads (inside CORS so hits still get CORS headers)
+if RESPONSE_CACHE_ENABLED:
+    app.add_middleware(ResponseCacheMiddleware, on_hit=_count_cached_view)
+
 # CORS Configuration
 app.add_middleware(
     CORSMiddleware,
@@ -37,29 +71,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if querycount.QUERY_COUNT_HEADER:
+    querycount.install(app)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="api/auth/login")
 
+@app.exception_handler(InvalidCursor)
+def invalid_cursor_handler(request: Request, exc: InvalidCursor):
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
+
+@app.exception_handler(PasswordPoolFull)
+def password_pool_full_handler(request: Request, exc: PasswordPoolFull):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Too many sign-in attempts in progress, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
+@app.exception_handler(PasswordPoolBroken)
+def password_pool_broken_handler(request: Request, exc: PasswordPoolBroken):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Sign-in is temporarily unavailable, try again shortly"},
+        headers={"Retry-After": "1"},
+    )
+
 # ==================== AUTH ENDPOINTS ====================
 
 @app.post("/api/auth/register", response_model=schemas.User, tags=["Authentication"])
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
     """Register new user (admin/author)"""
-    db_user = crud.get_user_by_email(db, email=user.email)
+    db_user = await run_in_threadpool(crud.get_user_by_email, db, email=user.email)
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    return crud.create_user(db=db, user=user)
+    password_hash = await password_pool.hash(user.password)
+    return await run_in_threadpool(crud.create_user, db=db, user=user, password_hash=password_hash)
 
 @app.post("/api/auth/login", tags=["Authentication"])
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login and get access token"""
-    user = auth.authenticate_user(db, form_data.username, form_data.password)
+    user = await auth.authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(data={"sub": user.email})
+    access_token = auth.create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer", "user": user}
 
 @app.get("/api/auth/me", response_model=schemas.User, tags=["Authentication"])
@@ -69,56 +127,77 @@ def get_current_user_info(current_user: models.User = Depends(auth.get_current_u
 
 # ==================== POSTS CRUD ====================
 
-@app.get("/api/posts", response_model=List[schemas.Post], tags=["Posts"])
-def get_posts(
+@app.get("/api/posts", response_model=schemas.PostPage, tags=["Posts"])
+async def get_posts(
     skip: int = 0,
     limit: int = 20,
     status: Optional[str] = None,
     category: Optional[str] = None,
-    tag: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    tag_match: str = Query("any", pattern="^(any|all)$"),
     search: Optional[str] = None,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db=Depends(get_async_read_db)
 ):
-    """Get all posts with filtering and pagination"""
-    return crud.get_posts(
+    """
+    Get all posts with filtering and pagination (pass next_cursor back as cursor).
+    Repeat `tag` to filter by several tag slugs; tag_match=all requires every tag.
+    """
+    # Rows come back as PostSummary-shaped dicts and are serialized as they are
+    page = await crud.get_posts_async(
         db,
         skip=skip,
         limit=limit,
         status=status,
         category=category,
         tag=tag,
-        search=search
+        tag_match=tag_match,
+        search=search,
+        cursor=cursor
     )
+    return ORJSONResponse(page)
 
 @app.get("/api/posts/{slug}", response_model=schemas.PostDetail, tags=["Posts"])
-def get_post(slug: str, db: Session = Depends(get_db)):
+async def get_post(slug: str, request: Request, db=Depends(get_async_read_db)):
     """Get single post by slug"""
-    post = crud.get_post_by_slug(db, slug=slug)
-    if not post:
+    payload = await crud.get_post_payload_async(db, slug=slug, route=read_route(request))
+    if payload is None:
         raise HTTPException(status_code=404, detail="Post not found")
 
-    # Increment view count
-    crud.increment_post_views(db, post_id=post.id)
+    # Buffered view count - flushed to the database in batches
+    view_counter.record(payload.meta["post_id"])
 
-    return post
+    return Response(payload.body, media_type="application/json")
+
+@app.get("/api/posts/{slug}/html", response_class=HTMLResponse, tags=["Posts"])
+def get_post_html(slug: str, request: Request, db: Session = Depends(get_db)):
+    """Server-rendered HTML body of a post"""
+    rendered = crud.get_post_html(db, slug=slug)
+    if rendered is None:
+        raise HTTPException(status_code=404, detail="Post not found")
+    content_hash, html = rendered
+    etag = f'"{content_hash}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return HTMLResponse(html, headers={"ETag": etag})
 
 @app.post("/api/posts", response_model=schemas.Post, tags=["Posts"])
 def create_post(
     post: schemas.PostCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Create new post (authenticated)"""
     return crud.create_post(db=db, post=post, author_id=current_user.id)
 
-@app.put("/api/posts/{post_id}", response_model=schemas.Post, tags=["Posts"])
+@app.put("/api/posts/{post_id}", response_model=schemas.PostUpdateResult, tags=["Posts"])
 def update_post(
     post_id: str,
     post: schemas.PostUpdate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
-    """Update post (authenticated)"""
+    """Update post (authenticated) - render_diff lists the re-rendered blocks for preview patching"""
     db_post = crud.get_post(db, post_id=post_id)
     if not db_post:
         raise HTTPException(status_code=404, detail="Post not found")
@@ -132,7 +211,7 @@ def update_post(
 @app.delete("/api/posts/{post_id}", tags=["Posts"])
 def delete_post(
     post_id: str,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Delete post (authenticated)"""
@@ -149,10 +228,15 @@ def delete_post(
 
 # ==================== COMMENTS CRUD ====================
 
-@app.get("/api/posts/{post_id}/comments", response_model=List[schemas.Comment], tags=["Comments"])
-def get_post_comments(post_id: str, db: Session = Depends(get_db)):
-    """Get all comments for a post"""
-    return crud.get_post_comments(db, post_id=post_id)
+@app.get("/api/posts/{post_id}/comments", response_model=schemas.CommentThreadPage, tags=["Comments"])
+async def get_post_comments(
+    post_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = None,
+    db=Depends(get_async_read_db)
+):
+    """Get approved comment threads for a post, newest thread first, replies nested (limit counts threads)"""
+    return await crud.get_comment_threads_async(db, post_id=post_id, limit=limit, cursor=cursor)
 
 @app.post("/api/posts/{post_id}/comments", response_model=schemas.Comment, tags=["Comments"])
 def create_comment(
@@ -163,11 +247,40 @@ def create_comment(
     """Create new comment"""
     return crud.create_comment(db=db, comment=comment, post_id=post_id)
 
+@app.get("/api/comments/pending", response_model=schemas.CommentPage, tags=["Comments"])
+def get_pending_comments(
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_identity),
+    db: Session = Depends(get_db)
+):
+    """Moderation queue: pending comments across all posts, newest first - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return crud.get_comments_by_status(db, status="pending", limit=limit, cursor=cursor)
+
+@app.post("/api/comments/moderate", response_model=schemas.CommentModerationResult, tags=["Comments"])
+def moderate_comments(
+    moderation: schemas.CommentModeration,
+    current_user: models.User = Depends(auth.get_current_identity),
+    db: Session = Depends(get_db)
+):
+    """
+    Approve, reject or delete comments in bulk - Admin only.
+    Matches comments by `ids` and/or filters (post_id, author_email, created_before, status).
+    """
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    affected = crud.moderate_comments(db, moderation)
+    if affected is None:
+        raise HTTPException(status_code=400, detail="Give ids or at least one filter")
+    return {"action": moderation.action, "affected": affected}
+
 @app.put("/api/comments/{comment_id}", response_model=schemas.Comment, tags=["Comments"])
 def update_comment_status(
     comment_id: str,
     status: str,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Update comment status (approve/reject) - Admin only"""
@@ -179,7 +292,7 @@ def update_comment_status(
 @app.delete("/api/comments/{comment_id}", tags=["Comments"])
 def delete_comment(
     comment_id: str,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Delete comment - Admin only"""
@@ -197,25 +310,30 @@ def rate_post(
     rating: schemas.RatingCreate,
     db: Session = Depends(get_db)
 ):
-    """Rate a post (1-5 stars)"""
-    return crud.create_rating(db=db, rating=rating, post_id=post_id)
+    """Rate a post (1-5 stars) - one vote per address"""
+    if not crud.get_post(db, post_id=post_id):
+        raise HTTPException(status_code=404, detail="Post not found")
+    db_rating = crud.create_rating(db=db, rating=rating, post_id=post_id)
+    if db_rating is None:
+        raise HTTPException(status_code=409, detail="Already rated")
+    return db_rating
 
 @app.get("/api/posts/{post_id}/rating", tags=["Ratings"])
-def get_post_rating(post_id: str, db: Session = Depends(get_db)):
+def get_post_rating(post_id: str, db: Session = Depends(get_read_db)):
     """Get average rating for post"""
     return crud.get_post_average_rating(db, post_id=post_id)
 
 # ==================== CATEGORIES CRUD ====================
 
 @app.get("/api/categories", response_model=List[schemas.Category], tags=["Categories"])
-def get_categories(db: Session = Depends(get_db)):
+async def get_categories(db=Depends(get_async_read_db)):
     """Get all categories"""
-    return crud.get_categories(db)
+    return await crud.get_categories_async(db)
 
 @app.post("/api/categories", response_model=schemas.Category, tags=["Categories"])
 def create_category(
     category: schemas.CategoryCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Create new category - Admin only"""
@@ -227,7 +345,7 @@ def create_category(
 def update_category(
     category_id: str,
     category: schemas.CategoryCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Update category - Admin only"""
@@ -238,7 +356,7 @@ def update_category(
 @app.delete("/api/categories/{category_id}", tags=["Categories"])
 def delete_category(
     category_id: str,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Delete category - Admin only"""
@@ -250,14 +368,14 @@ def delete_category(
 # ==================== TAGS CRUD ====================
 
 @app.get("/api/tags", response_model=List[schemas.Tag], tags=["Tags"])
-def get_tags(db: Session = Depends(get_db)):
+async def get_tags(db=Depends(get_async_read_db)):
     """Get all tags"""
-    return crud.get_tags(db)
+    return await crud.get_tags_async(db)
 
 @app.post("/api/tags", response_model=schemas.Tag, tags=["Tags"])
 def create_tag(
     tag: schemas.TagCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Create new tag - Admin only"""
@@ -265,22 +383,28 @@ def create_tag(
         raise HTTPException(status_code=403, detail="Admin access required")
     return crud.create_tag(db=db, tag=tag)
 
+@app.get("/api/taxonomy/counts", response_model=schemas.TaxonomyCounts, tags=["Categories", "Tags"])
+async def get_taxonomy_counts(db=Depends(get_async_read_db)):
+    """Published post count per category and tag slug"""
+    return await crud.get_taxonomy_counts_async(db)
+
 # ==================== MEDIA CRUD ====================
 
-@app.get("/api/media", response_model=List[schemas.Media], tags=["Media"])
+@app.get("/api/media", response_model=schemas.MediaPage, tags=["Media"])
 def get_media(
     skip: int = 0,
     limit: int = 50,
-    current_user: models.User = Depends(auth.get_current_user),
+    cursor: Optional[str] = None,
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Get media library - Authenticated"""
-    return crud.get_media(db, skip=skip, limit=limit)
+    return crud.get_media(db, skip=skip, limit=limit, cursor=cursor)
 
 @app.post("/api/media/upload", response_model=schemas.Media, tags=["Media"])
 def upload_media(
     media: schemas.MediaCreate,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Upload media file - Authenticated"""
@@ -289,7 +413,7 @@ def upload_media(
 @app.delete("/api/media/{media_id}", tags=["Media"])
 def delete_media(
     media_id: str,
-    current_user: models.User = Depends(auth.get_current_user),
+    current_user: models.User = Depends(auth.get_current_identity),
     db: Session = Depends(get_db)
 ):
     """Delete media - Authenticated"""
@@ -298,51 +422,116 @@ def delete_media(
 
 # ==================== ANALYTICS ====================
 
-@app.post("/api/analytics/view", tags=["Analytics"])
-def track_page_view(
-    view: schemas.PageViewCreate,
-    db: Session = Depends(get_db)
-):
-    """Track page view"""
-    return crud.create_page_view(db=db, view=view)
+@app.post("/api/analytics/view", status_code=status.HTTP_202_ACCEPTED, tags=["Analytics"])
+async def track_page_view(view: schemas.PageViewCreate, request: Request):
+    """Track page view - queued and written in batches"""
+    row = view.dict()
+    row["post_id"] = str(row["post_id"])
+    row["country"] = country_from_headers(request.headers) or None
+    row["viewed_at"] = datetime.now(timezone.utc)
+    if not page_view_ingestor.submit(row):
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Page view queue is full",
+            headers={"Retry-After": "1"},
+        )
+    return {"status": "accepted"}
+
+@app.get("/api/analytics/ingestion", tags=["Analytics"])
+def get_ingestion_metrics(current_user: models.User = Depends(auth.get_current_identity)):
+    """Page view queue depth and throughput - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    return page_view_ingestor.metrics()
 
 @app.get("/api/analytics/posts/{post_id}", tags=["Analytics"])
 def get_post_analytics(
     post_id: str,
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    granularity: str = Query("day", pattern="^(day|hour)$"),
+    current_user: models.User = Depends(auth.get_current_identity),
+    db: Session = Depends(get_read_db)
 ):
-    """Get analytics for specific post - Authenticated"""
-    return crud.get_post_analytics(db, post_id=post_id)
+    """Get analytics for specific post from the rollups (default: last 30 days) - Authenticated"""
+    return crud.get_post_analytics(db, post_id=post_id, start=start, end=end, granularity=granularity)
 
 @app.get("/api/analytics/dashboard", tags=["Analytics"])
 def get_dashboard_analytics(
-    current_user: models.User = Depends(auth.get_current_user),
-    db: Session = Depends(get_db)
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    current_user: models.User = Depends(auth.get_current_identity),
+    db: Session = Depends(get_read_db)
 ):
-    """Get overall dashboard analytics - Admin only"""
+    """Get overall dashboard analytics (views for start..end, default last 30 days) - Admin only"""
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Admin access required")
 
+    start, end = crud.analytics_range(start, end)
     return {
+        "start": start,
+        "end": end,
         "total_posts": crud.count_posts(db),
-        "total_views": crud.count_total_views(db),
+        "total_views": crud.count_total_views(db, start=start, end=end),
         "total_comments": crud.count_comments(db),
-        "popular_posts": crud.get_popular_posts(db, limit=10),
+        "popular_posts": crud.get_popular_posts(db, limit=10, start=start, end=end),
         "recent_comments": crud.get_recent_comments(db, limit=10),
     }
 
 # ==================== SEARCH ====================
 
-@app.get("/api/search", response_model=List[schemas.Post], tags=["Search"])
-def search_posts(
+@app.get("/api/search", response_model=schemas.SearchResults, tags=["Search"])
+async def search_posts(
     q: str,
     skip: int = 0,
     limit: int = 20,
-    db: Session = Depends(get_db)
+    cursor: Optional[str] = None,
+    db=Depends(get_async_read_db)
 ):
-    """Full-text search for posts"""
-    return crud.search_posts(db, query=q, skip=skip, limit=limit)
+    """Full-text search for posts (BM25 ranked, Hebrew-aware)"""
+    return ORJSONResponse(await crud.search_posts_async(db, query=q, skip=skip, limit=limit, cursor=cursor))
+
+# ==================== FEEDS ====================
+
+# Feed state is read from the primary, like the rows the documents stream
+# (feeds._rows), so a lagging replica never gets cached as the current state
+
+@app.get("/rss.xml", tags=["Feeds"])
+def rss_feed(request: Request, db: Session = Depends(get_db)):
+    """RSS 2.0 feed of the newest published posts"""
+    state = feeds.feed_state(db)
+    return feeds.feed_response(request, state, "rss", feeds.rss_chunks())
+
+@app.get("/sitemap.xml", tags=["Feeds"])
+def sitemap(request: Request, db: Session = Depends(get_db)):
+    """Sitemap of published posts; a sitemap index over /sitemap-N.xml past 50,000 URLs"""
+    state = feeds.feed_state(db)
+    if feeds.sitemap_pages(state) > 1:
+        base_url = str(request.base_url).rstrip("/")
+        return feeds.feed_response(request, state, "sitemap-index", feeds.sitemap_index_chunks(state, base_url))
+    return feeds.feed_response(request, state, "sitemap-1", feeds.sitemap_chunks(1))
+
+@app.get("/sitemap-{page:int}.xml", tags=["Feeds"])
+def sitemap_page(page: int, request: Request, db: Session = Depends(get_db)):
+    """One file of a split sitemap"""
+    state = feeds.feed_state(db)
+    if not 1 <= page <= feeds.sitemap_pages(state):
+        raise HTTPException(status_code=404, detail="Sitemap page not found")
+    return feeds.feed_response(request, state, f"sitemap-{page}", feeds.sitemap_chunks(page))
+
+# ==================== DIAGNOSTICS ====================
+
+@app.get("/api/diagnostics/db", tags=["Diagnostics"])
+def get_database_diagnostics(current_user: models.User = Depends(auth.get_current_identity)):
+    """Connection pool usage and checkout wait times - Admin only"""
+    if current_user.role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    pools = {"sync": pool_status(engine)}
+    if async_engine is not None:
+        pools["async"] = pool_status(async_engine.sync_engine)
+    for i, read_engine in enumerate(read_engines):
+        pools[f"replica_{i}"] = pool_status(read_engine)
+    return pools
 
 # ==================== HEALTH CHECK ====================
 
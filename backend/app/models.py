@@ -3,27 +3,34 @@ SQLAlchemy Database Models
 Complete schema for Hebrew Markdown Blog
 """
 
-from sqlalchemy import Column, String, Integer, Boolean, Text, String(36), ForeignKey, DateTime, Table, Float
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy import Column, String, Integer, Boolean, Text, ForeignKey, DateTime, Date, Table, Float, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 import uuid
 
+from .compression import CompressedText
 from .database import Base
 
+
+def generate_uuid():
+    return str(uuid.uuid4())
+
+
 # Many-to-Many relationship tables
 post_categories = Table(
     'post_categories',
     Base.metadata,
-    Column('post_id', String(36), String(36), ForeignKey('posts.id', ondelete='CASCADE')),
-    Column('category_id', String(36), String(36), ForeignKey('categories.id', ondelete='CASCADE'))
+    Column('post_id', String(36), ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True),
+    Column('category_id', String(36), ForeignKey('categories.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_post_categories_category_post', 'category_id', 'post_id')
 )
 
 post_tags = Table(
     'post_tags',
     Base.metadata,
-    Column('post_id', String(36), String(36), ForeignKey('posts.id', ondelete='CASCADE')),
-    Column('tag_id', String(36), String(36), ForeignKey('tags.id', ondelete='CASCADE'))
+    Column('post_id', String(36), ForeignKey('posts.id', ondelete='CASCADE'), primary_key=True),
+    Column('tag_id', String(36), ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+    Index('ix_post_tags_tag_post', 'tag_id', 'post_id')
 )
 
 # Models
@@ -53,14 +60,21 @@ class Post(Base):
     slug = Column(String(255), unique=True, nullable=False, index=True)
     title = Column(String(500), nullable=False)
     excerpt = Column(Text)
-    content = Column(Text, nullable=False)  # Markdown content
-    content_mdx = Column(Text, nullable=False)  # MDX processed content
+    content = Column(CompressedText, nullable=False)  # Markdown content
+    content_mdx = Column(CompressedText, nullable=False)  # MDX processed content
+    content_html = Column(CompressedText)  # server-rendered HTML (see rendering.py)
+    content_hash = Column(String(64))  # hash of the content content_html was rendered from
+    block_hashes = Column(Text)  # JSON list of rendered block hashes, in order
     featured_image = Column(Text)
     status = Column(String(20), default="draft")  # draft, published
-    author_id = Column(UUID(as_uuid=True), String(36), ForeignKey("users.id"))
-    reading_time = Column(Integer)  # minutes
+    author_id = Column(String(36), ForeignKey("users.id"))
+    excerpt_generated = Column(Boolean, default=False)  # excerpt derived from content, not written by the author
+    reading_time = Column(Integer)  # minutes, computed at write time
+    toc = Column(JSON)  # [{"level", "id", "title"}] from rendered headings
     views_count = Column(Integer, default=0)
     likes_count = Column(Integer, default=0)
+    rating_sum = Column(Integer, default=0, server_default="0", nullable=False)  # maintained by crud.create_rating
+    rating_count = Column(Integer, default=0, server_default="0", nullable=False)
     published_at = Column(DateTime(timezone=True))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
@@ -73,6 +87,19 @@ class Post(Base):
     ratings = relationship("Rating", back_populates="post", cascade="all, delete-orphan")
     page_views = relationship("PageView", back_populates="post", cascade="all, delete-orphan")
 
+    # Block-level render diff of the last update_post (not persisted)
+    render_diff = None
+
+    @property
+    def average_rating(self) -> float:
+        return round(self.rating_sum / self.rating_count, 2) if self.rating_count else 0.0
+
+    __table_args__ = (
+        # Keyset pagination: newest first, optionally filtered by status
+        Index("ix_posts_created_at_id", "created_at", "id"),
+        Index("ix_posts_status_created_at_id", "status", "created_at", "id"),
+    )
+
 
 class Category(Base):
     __tablename__ = "categories"
@@ -81,6 +108,7 @@ class Category(Base):
     name = Column(String(100), nullable=False)
     slug = Column(String(100), unique=True, nullable=False, index=True)
     description = Column(Text)
+    post_count = Column(Integer, default=0, server_default="0", nullable=False)  # published posts, maintained by crud
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
@@ -93,6 +121,7 @@ class Tag(Base):
     id = Column(String(36), primary_key=True, default=generate_uuid)
     name = Column(String(50), nullable=False)
     slug = Column(String(50), unique=True, nullable=False, index=True)
+    post_count = Column(Integer, default=0, server_default="0", nullable=False)  # published posts, maintained by crud
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
@@ -103,8 +132,8 @@ class Comment(Base):
     __tablename__ = "comments"
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    post_id = Column(UUID(as_uuid=True), String(36), ForeignKey("posts.id", ondelete="CASCADE"))
-    parent_id = Column(UUID(as_uuid=True), String(36), ForeignKey("comments.id", ondelete="CASCADE"), nullable=True)
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"))
+    parent_id = Column(String(36), ForeignKey("comments.id", ondelete="CASCADE"), nullable=True)
     author_name = Column(String(100), nullable=False)
     author_email = Column(String(255), nullable=False)
     content = Column(Text, nullable=False)
@@ -115,12 +144,20 @@ class Comment(Base):
     post = relationship("Post", back_populates="comments")
     replies = relationship("Comment", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_comments_post_status_created_at_id", "post_id", "status", "created_at", "id"),
+        # Walking a thread down from its root (recursive CTE in crud.get_comment_threads)
+        Index("ix_comments_parent_id", "parent_id"),
+        # Moderation queue: pending comments across all posts, newest first
+        Index("ix_comments_status_created_at_id", "status", "created_at", "id"),
+    )
+
 
 class Rating(Base):
     __tablename__ = "ratings"
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    post_id = Column(UUID(as_uuid=True), String(36), ForeignKey("posts.id", ondelete="CASCADE"))
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"))
     user_ip = Column(String(45), nullable=False)
     rating = Column(Integer, nullable=False)  # 1-5
     created_at = Column(DateTime(timezone=True), server_default=func.now())
@@ -128,6 +165,11 @@ class Rating(Base):
     # Relationships
     post = relationship("Post", back_populates="ratings")
 
+    __table_args__ = (
+        # One vote per address per post; also serves lookups by post_id
+        Index("ux_ratings_post_user_ip", "post_id", "user_ip", unique=True),
+    )
+
 
 class Media(Base):
     __tablename__ = "media"
@@ -140,33 +182,128 @@ class Media(Base):
     size_bytes = Column(Integer)
     width = Column(Integer)
     height = Column(Integer)
-    uploaded_by = Column(UUID(as_uuid=True), String(36), ForeignKey("users.id"))
+    uploaded_by = Column(String(36), ForeignKey("users.id"))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationships
     uploaded_by_user = relationship("User", back_populates="media")
 
+    __table_args__ = (
+        Index("ix_media_created_at_id", "created_at", "id"),
+    )
+
 
 class PageView(Base):
     __tablename__ = "page_views"
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    post_id = Column(UUID(as_uuid=True), String(36), ForeignKey("posts.id", ondelete="CASCADE"))
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"))
     visitor_ip = Column(String(45))
     user_agent = Column(Text)
     referrer = Column(Text)
-    country = Column(String(2))
-    viewed_at = Column(DateTime(timezone=True), server_default=func.now())
+    country = Column(String(2))  # ISO code from the edge's geo header, if any
+    viewed_at = Column(DateTime(timezone=True), server_default=func.now())  # when the view happened
+    ingested_at = Column(DateTime(timezone=True), server_default=func.now())  # set by the database on insert
 
     # Relationships
     post = relationship("Post", back_populates="page_views")
 
+    __table_args__ = (
+        # Rollup job scans new rows by insert time
+        Index("ix_page_views_ingested_at", "ingested_at"),
+    )
+
+
+# Views per post per hour, by referrer host and country (maintained by rollup.py)
+class PageViewHourly(Base):
+    __tablename__ = "page_view_rollup_hourly"
+
+    bucket = Column(DateTime, primary_key=True)  # start of the hour, UTC
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    referrer = Column(String(255), primary_key=True, default="")  # "" = direct
+    country = Column(String(2), primary_key=True, default="")
+    views = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_page_view_rollup_hourly_post_bucket", "post_id", "bucket"),
+    )
+
+
+# Views per post per day, by referrer host and country (maintained by rollup.py)
+class PageViewDaily(Base):
+    __tablename__ = "page_view_rollup_daily"
+
+    day = Column(Date, primary_key=True)  # UTC
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    referrer = Column(String(255), primary_key=True, default="")
+    country = Column(String(2), primary_key=True, default="")
+    views = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_page_view_rollup_daily_post_day", "post_id", "day"),
+    )
+
+
+# High-water mark of page_views already folded into the rollup tables
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+
+    name = Column(String(50), primary_key=True)
+    watermark = Column(DateTime(timezone=True), nullable=False)
+
 
 class ReadingSession(Base):
     __tablename__ = "reading_sessions"
 
     id = Column(String(36), primary_key=True, default=generate_uuid)
-    post_id = Column(UUID(as_uuid=True), String(36), ForeignKey("posts.id", ondelete="CASCADE"))
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"))
     visitor_ip = Column(String(45))
     duration_seconds = Column(Integer)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# Rendered HTML keyed by content hash - identical Markdown blocks are rendered once
+class RenderCache(Base):
+    __tablename__ = "render_cache"
+
+    content_hash = Column(String(64), primary_key=True)
+    html = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class SearchDocument(Base):
+    __tablename__ = "search_documents"
+
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True)
+    length = Column(Integer, nullable=False)  # weighted token count, for BM25 length normalization
+
+
+class SearchPosting(Base):
+    __tablename__ = "search_postings"
+
+    # Primary key (term, post_id) doubles as the term lookup index
+    term = Column(String(64), primary_key=True)
+    post_id = Column(String(36), ForeignKey("posts.id", ondelete="CASCADE"), primary_key=True, index=True)
+    frequency = Column(Integer, nullable=False)  # field-weighted term frequency
+    # The term occurs as written in the post, not only as a prefix-stripped
+    # form of a longer word; prefix completion only follows these postings
+    surface = Column(Boolean, nullable=False, default=True)
+
+
+class SearchTerm(Base):
+    __tablename__ = "search_terms"
+
+    # Document frequencies, kept up to date by index_post/remove_post so
+    # ranking never counts postings
+    term = Column(String(64), primary_key=True)
+    documents = Column(Integer, nullable=False, default=0)
+    surface_documents = Column(Integer, nullable=False, default=0)
+
+
+class SearchStats(Base):
+    __tablename__ = "search_stats"
+
+    # A single row (id 1): corpus size and total length for BM25
+    id = Column(Integer, primary_key=True)
+    documents = Column(Integer, nullable=False, default=0)
+    total_length = Column(Integer, nullable=False, default=0)
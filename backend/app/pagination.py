@@ -0,0 +1,75 @@
+"""
+Keyset (cursor) pagination helpers
+Cursors are opaque URL-safe tokens wrapping the sort key of the last row served
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, List, Optional, Tuple
+
+from sqlalchemy import and_, literal, or_
+
+
+class InvalidCursor(ValueError):
+    """Raised when a client sends a cursor we did not issue"""
+
+
+def encode_cursor(*values: Any) -> str:
+    """Encode a sort key tuple such as (created_at, id) or (rank, id)"""
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    """Decode a cursor back into its sort key values"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+    except (ValueError, TypeError):
+        raise InvalidCursor("Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor("Invalid cursor")
+    return values
+
+def decode_time_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Decode a (created_at, id) cursor"""
+    created_at, row_id = decode_cursor(cursor, 2)
+    try:
+        return datetime.fromisoformat(created_at), str(row_id)
+    except (TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+
+def _bind_time(query, value: datetime):
+    # SQLite keeps server_default timestamps as "YYYY-MM-DD HH:MM:SS" text,
+    # so bind the cursor in the same text form for the comparison to line up
+    if query.session.get_bind().dialect.name == "sqlite":
+        timespec = "microseconds" if value.microsecond else "seconds"
+        return literal(value.replace(tzinfo=None).isoformat(sep=" ", timespec=timespec))
+    return value
+
+def after_time_cursor(query, model, cursor: Optional[str]):
+    """
+    Apply newest-first keyset ordering on (created_at, id).
+
+    Rows after the cursor are selected with a range condition, so the
+    database seeks straight into the (created_at, id) index instead of
+    scanning and discarding OFFSET rows.
+    """
+    if cursor:
+        created_at, row_id = decode_time_cursor(cursor)
+        created_at = _bind_time(query, created_at)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < row_id)
+        ))
+    return query.order_by(model.created_at.desc(), model.id.desc())
+
+def time_page(rows: list, limit: int) -> dict:
+    """Build a page from limit + 1 rows fetched in (created_at, id) order"""
+    items = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit and items:
+        last = items[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return {"items": items, "next_cursor": next_cursor}
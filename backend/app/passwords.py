@@ -0,0 +1,124 @@
+"""
+Password hashing pool
+bcrypt runs in a small process pool so login bursts never hold the GIL or API threads
+"""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Optional, Tuple
+
+from passlib.context import CryptContext
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(2, os.cpu_count() or 1))))
+# Hash/verify calls allowed in flight (running + queued) before new ones get 503
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", "16"))
+
+PASSWORD_BCRYPT_ROUNDS = int(os.getenv("PASSWORD_BCRYPT_ROUNDS", "12"))
+
+# Hashes made with a deprecated scheme or fewer rounds than configured are
+# flagged by verify_and_update() and replaced on the user's next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=PASSWORD_BCRYPT_ROUNDS,
+    bcrypt__min_rounds=PASSWORD_BCRYPT_ROUNDS,
+)
+
+
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+def verify_and_update(password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+    """(valid, new_hash) - new_hash is set when the stored hash uses outdated parameters"""
+    return pwd_context.verify_and_update(password, hashed)
+
+
+class PasswordPoolFull(Exception):
+    """Too many hash/verify calls are already waiting"""
+
+
+class PasswordPoolBroken(Exception):
+    """A worker died mid-call; the pool has been replaced for the next call"""
+
+
+class PasswordHashPool:
+    """
+    Bounded process pool for bcrypt.
+
+    Workers are started lazily with the spawn method, so they only import
+    this module (not the app, its engine or its threads). At most
+    `max_pending` calls run or wait at once; beyond that submit fails fast
+    with PasswordPoolFull instead of growing an unbounded queue. A worker that
+    dies (OOM kill, crash) breaks the whole executor: it is replaced and the
+    calls it failed raise PasswordPoolBroken.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_pending: int = PASSWORD_HASH_QUEUE):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self.restarts = 0
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise PasswordPoolFull()
+            self.pending += 1
+            executor = self._get_executor()
+        try:
+            return await asyncio.wrap_future(executor.submit(fn, *args))
+        except BrokenProcessPool:
+            self._replace(executor)
+            raise PasswordPoolBroken()
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def _replace(self, broken: ProcessPoolExecutor):
+        # Every call in flight on the broken executor lands here; only the
+        # first one drops it, the rest find a fresh executor already in place
+        with self._lock:
+            if self._executor is not broken:
+                return
+            self._executor = None
+            self.restarts += 1
+        broken.shutdown(wait=False)
+
+    async def hash(self, password: str) -> str:
+        return await self._run(hash_password, password)
+
+    async def verify(self, password: str, hashed: str) -> Tuple[bool, Optional[str]]:
+        return await self._run(verify_and_update, password, hashed)
+
+    def metrics(self) -> dict:
+        return {
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "restarts": self.restarts,
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+
+password_pool = PasswordHashPool()
@@ -0,0 +1,99 @@
+"""
+Write-time post metadata
+Reading time, excerpt and table of contents derived once from the rendered HTML
+"""
+
+import math
+import re
+from html.parser import HTMLParser
+from typing import List
+
+from . import models
+
+# Words per minute. Hebrew words carry attached prefixes (ו/ה/ב/ל/מ/ש/כ),
+# so fewer of them are read per minute than English words.
+HEBREW_WPM = 180
+LATIN_WPM = 230
+
+EXCERPT_LENGTH = 200
+TOC_LEVELS = {"h1", "h2", "h3", "h4"}
+
+WORD_RE = re.compile(r"[^\W_]+(?:['\"׳״][^\W_]+)*")
+HEBREW_RE = re.compile(r"[א-ת]")
+
+
+class _TextExtractor(HTMLParser):
+    """Collects body text, paragraph text and headings from rendered post HTML"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.text: List[str] = []
+        self.paragraphs: List[str] = []
+        self.headings: List[dict] = []
+        self._code_depth = 0
+        self._paragraph = None
+        self._heading = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "pre":
+            self._code_depth += 1
+        elif tag == "p" and self._code_depth == 0:
+            self._paragraph = []
+        elif tag in TOC_LEVELS:
+            self._heading = {"level": int(tag[1]), "id": dict(attrs).get("id"), "parts": []}
+
+    def handle_endtag(self, tag):
+        if tag == "pre":
+            self._code_depth = max(0, self._code_depth - 1)
+        elif tag == "p" and self._paragraph is not None:
+            paragraph = " ".join("".join(self._paragraph).split())
+            if paragraph:
+                self.paragraphs.append(paragraph)
+            self._paragraph = None
+        elif self._heading is not None and tag == f"h{self._heading['level']}":
+            title = " ".join("".join(self._heading.pop("parts")).split())
+            if title and self._heading["id"]:
+                self.headings.append({**self._heading, "title": title})
+            self._heading = None
+
+    def handle_data(self, data):
+        self.text.append(data)
+        if self._paragraph is not None:
+            self._paragraph.append(data)
+        if self._heading is not None:
+            self._heading["parts"].append(data)
+
+
+def reading_time(text: str) -> int:
+    """Estimated reading time in whole minutes (at least 1)"""
+    hebrew = latin = 0
+    for word in WORD_RE.findall(text):
+        if HEBREW_RE.search(word):
+            hebrew += 1
+        else:
+            latin += 1
+    return max(1, math.ceil(hebrew / HEBREW_WPM + latin / LATIN_WPM))
+
+def make_excerpt(paragraphs: List[str], length: int = EXCERPT_LENGTH) -> str:
+    """Leading paragraph text cut at a word boundary"""
+    text = " ".join(paragraphs)
+    if len(text) <= length:
+        return text
+    cut = text[:length].rsplit(" ", 1)[0]
+    return cut.rstrip(".,;:!?-–— ") + "…"
+
+def apply_metadata(post: models.Post, regenerate_excerpt: bool):
+    """
+    Fill reading_time, toc and (when requested) excerpt from post.content_html.
+
+    Called after rendering whenever the content changed; the caller decides
+    whether the excerpt is generated or was written by the author.
+    """
+    parser = _TextExtractor()
+    parser.feed(post.content_html or "")
+    parser.close()
+    post.reading_time = reading_time("".join(parser.text))
+    post.toc = [{"level": h["level"], "id": h["id"], "title": h["title"]} for h in parser.headings]
+    if regenerate_excerpt:
+        post.excerpt = make_excerpt(parser.paragraphs) or None
+        post.excerpt_generated = True
@@ -0,0 +1,112 @@
+"""
+SQL query counting for N+1 regression checks
+Counts statements per block or per request and asserts per-endpoint query budgets
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from .database import async_engine, engine as default_engine
+
+# Expected statements per request for the read endpoints, measured with
+# RESPONSE_CACHE_ENABLED=false (response cache hits run none).
+# GET /api/posts/{slug}: post + author (joined), categories (selectin),
+# tags (selectin); the view count is buffered and written in batches
+QUERY_BUDGETS = {
+    "GET /api/posts": 1,
+    "GET /api/posts/{slug}": 3,
+    "GET /api/posts/{post_id}/comments": 1,
+    "GET /api/categories": 1,
+    "GET /api/tags": 1,
+}
+
+# Adds an X-Query-Count response header (development only)
+QUERY_COUNT_HEADER = os.getenv("QUERY_COUNT_HEADER", "false").lower() == "true"
+
+_request_counter: ContextVar[Optional["QueryCounter"]] = ContextVar("request_query_counter", default=None)
+
+
+class QueryCounter:
+    """Collects the SQL statements executed while it is active"""
+
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+def _engines(engine):
+    # The async engine (ASYNC_DATABASE) serves the async read endpoints and
+    # counts together with the default one
+    if engine is default_engine and async_engine is not None:
+        return [engine, async_engine.sync_engine]
+    return [engine]
+
+@contextmanager
+def count_queries(engine=default_engine):
+    """Count every statement executed on the engine inside the block"""
+    counter = QueryCounter()
+    for target in _engines(engine):
+        event.listen(target, "before_cursor_execute", counter.record)
+    try:
+        yield counter
+    finally:
+        for target in _engines(engine):
+            event.remove(target, "before_cursor_execute", counter.record)
+
+@contextmanager
+def assert_num_queries(expected: int, engine=default_engine):
+    """Fail if the block does not execute exactly `expected` statements"""
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count != expected:
+        listing = "\n".join(f"  {i + 1}. {sql}" for i, sql in enumerate(counter.statements))
+        raise AssertionError(f"Expected {expected} queries, got {counter.count}:\n{listing}")
+
+def assert_endpoint_budget(client, method: str, route: str, url: Optional[str] = None, **kwargs):
+    """
+    Call an endpoint through a TestClient and check it against QUERY_BUDGETS.
+
+    `route` is the path template used as the budget key; pass the concrete
+    `url` when the route has path parameters.
+    """
+    with assert_num_queries(QUERY_BUDGETS[f"{method} {route}"]):
+        return client.request(method, url or route, **kwargs)
+
+# ==================== PER-REQUEST HEADER ====================
+
+def _record_request_statement(conn, cursor, statement, parameters, context, executemany):
+    counter = _request_counter.get()
+    if counter is not None:
+        counter.statements.append(statement)
+
+
+class QueryCountMiddleware(BaseHTTPMiddleware):
+    """Report the number of SQL statements a request executed in X-Query-Count"""
+
+    async def dispatch(self, request, call_next):
+        counter = QueryCounter()
+        token = _request_counter.set(counter)
+        try:
+            response = await call_next(request)
+        finally:
+            _request_counter.reset(token)
+        response.headers["X-Query-Count"] = str(counter.count)
+        return response
+
+
+def install(app, engine=default_engine):
+    """Enable the X-Query-Count header on an app"""
+    for target in _engines(engine):
+        event.listen(target, "before_cursor_execute", _record_request_statement)
+    app.add_middleware(QueryCountMiddleware)
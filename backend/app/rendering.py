@@ -0,0 +1,291 @@
+"""
+Server-side Markdown rendering
+Markdown → HTML with RTL-aware blocks, heading anchors and a per-block content-hash render cache
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import datetime, timedelta
+from html import unescape
+import xml.etree.ElementTree as etree
+from typing import Dict, List, Optional, Tuple
+
+import markdown
+from markdown import util
+from markdown.extensions import Extension
+from markdown.extensions.toc import slugify_unicode, unique
+from markdown.treeprocessors import Treeprocessor
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+try:  # Server-side syntax highlighting when Pygments is installed
+    import pygments  # noqa: F401
+    HIGHLIGHT = True
+except ImportError:
+    HIGHLIGHT = False
+
+# Part of every content hash - bump it when the output format changes
+RENDERER_VERSION = f"2{'h' if HIGHLIGHT else ''}"
+
+# Blocks whose direction the browser should infer from their first strong character
+DIR_AUTO_TAGS = {"p", "h1", "h2", "h3", "h4", "h5", "h6", "li", "blockquote", "td", "th", "dt", "dd"}
+
+
+class DirectionTreeprocessor(Treeprocessor):
+    """Mark text blocks dir="auto" and code blocks dir="ltr" so mixed Hebrew/English renders correctly"""
+
+    def run(self, root: etree.Element):
+        for element in root.iter():
+            if element.tag == "p" and len(element) == 0 and util.HTML_PLACEHOLDER_RE.fullmatch((element.text or "").strip()):
+                continue  # stashed raw HTML / code block - must stay a bare <p> to be unwrapped
+            if element.tag in DIR_AUTO_TAGS:
+                element.set("dir", "auto")
+            elif element.tag == "pre" or (element.tag == "div" and "highlight" in element.get("class", "")):
+                element.set("dir", "ltr")
+
+
+class DirectionExtension(Extension):
+    def extendMarkdown(self, md):
+        md.treeprocessors.register(DirectionTreeprocessor(md), "direction", 1)
+
+
+# URL schemes links and images may use; relative URLs and #fragments have none
+SAFE_URL_SCHEMES = {"", "http", "https", "mailto", "tel"}
+URL_ATTRIBUTES = {"a": "href", "img": "src"}
+# Browsers ignore whitespace and control characters anywhere in a scheme
+URL_IGNORED_RE = re.compile(r"[\x00-\x20\x7f]+")
+
+
+def safe_url(url: str) -> bool:
+    # Character references are decoded by the browser before it reads the scheme
+    scheme, sep, _ = URL_IGNORED_RE.sub("", unescape(url)).partition(":")
+    if not sep or any(ch in scheme for ch in "/?#"):
+        return True  # no scheme: a relative URL
+    return scheme.lower() in SAFE_URL_SCHEMES
+
+
+class SafeUrlTreeprocessor(Treeprocessor):
+    """Drop link and image URLs with script-capable schemes (javascript:, data:, vbscript:, ...)"""
+
+    def run(self, root: etree.Element):
+        for element in root.iter():
+            attribute = URL_ATTRIBUTES.get(element.tag)
+            if attribute and not safe_url(element.get(attribute, "")):
+                element.set(attribute, "#")
+
+
+class SafeHtmlExtension(Extension):
+    """
+    Post bodies come from any registered author and are served as HTML from
+    the API origin and the static export, so raw HTML in Markdown is not
+    passed through: it renders as escaped text. Unsafe URLs are neutralized.
+    """
+
+    def extendMarkdown(self, md):
+        md.preprocessors.deregister("html_block")
+        md.inlinePatterns.deregister("html")
+        md.treeprocessors.register(SafeUrlTreeprocessor(md), "safe_urls", -1)
+
+
+def _extensions():
+    extensions = [
+        "fenced_code",
+        "tables",
+        "sane_lists",
+        "toc",
+        DirectionExtension(),
+        SafeHtmlExtension(),
+    ]
+    configs = {
+        # Keep Hebrew letters in heading anchors (the default slugify drops them)
+        "toc": {"slugify": slugify_unicode, "permalink": False},
+    }
+    if HIGHLIGHT:
+        extensions.append("codehilite")
+        configs["codehilite"] = {"css_class": "highlight", "guess_lang": False}
+    return extensions, configs
+
+_local = threading.local()
+
+def _markdown() -> markdown.Markdown:
+    # Markdown instances keep parser state, so each thread reuses its own
+    md = getattr(_local, "md", None)
+    if md is None:
+        extensions, configs = _extensions()
+        md = _local.md = markdown.Markdown(extensions=extensions, extension_configs=configs, output_format="html")
+    return md
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(f"{RENDERER_VERSION}\0{content}".encode("utf-8")).hexdigest()
+
+def is_current(post: models.Post) -> bool:
+    """Whether post.content_html was rendered from its current content by this renderer version"""
+    return post.content_html is not None and post.content_hash == content_hash(post.content)
+
+def render_markdown(content: str) -> str:
+    """Render Markdown to an HTML fragment (uncached)"""
+    md = _markdown()
+    try:
+        return md.convert(content or "")
+    finally:
+        md.reset()
+
+# ==================== BLOCK RENDERING ====================
+
+FENCE_RE = re.compile(r"^\s{0,3}(`{3,}|~{3,})")
+LIST_ITEM_RE = re.compile(r"^\s{0,3}([*+-]|\d+[.)])\s")
+REFERENCE_RE = re.compile(r"^\s{0,3}\[[^\]]+\]:\s*\S.*$", re.MULTILINE)
+HEADING_ID_RE = re.compile(r'(<h[1-6]\b[^>]*?\sid=")([^"]*)(")')
+CACHE_LOOKUP_CHUNK = 500
+
+# Autosaves leave a render_cache row per block version; rows older than this
+# are purged (a purged block is simply rendered again when next saved)
+RENDER_CACHE_MAX_AGE = timedelta(days=float(os.getenv("RENDER_CACHE_MAX_AGE_DAYS", "7")))
+RENDER_CACHE_PURGE_EVERY = 500  # inserted rows between purges, per process
+_inserted = 0
+_inserted_lock = threading.Lock()
+
+def split_blocks(content: str) -> List[str]:
+    """
+    Split Markdown into top-level blocks that render independently.
+
+    Blocks are separated by blank lines outside fenced code. Indented
+    continuations and consecutive list items are merged into the preceding
+    block, so loose lists and nested content keep their structure.
+    """
+    blocks: List[List[str]] = []
+    current: List[str] = []
+    fence = None
+    for line in (content or "").splitlines():
+        if fence:
+            current.append(line)
+            if line.strip().startswith(fence):
+                fence = None
+            continue
+        match = FENCE_RE.match(line)
+        if match:
+            fence = match.group(1)[0] * len(match.group(1))
+            current.append(line)
+        elif line.strip():
+            current.append(line)
+        elif current:
+            blocks.append(current)
+            current = []
+    if current:
+        blocks.append(current)
+
+    merged: List[str] = []
+    for lines in blocks:
+        first = lines[0]
+        continues = first[:1] in (" ", "\t") or (
+            LIST_ITEM_RE.match(first) and merged and LIST_ITEM_RE.match(merged[-1])
+        )
+        if continues and merged:
+            merged[-1] += "\n\n" + "\n".join(lines)
+        else:
+            merged.append("\n".join(lines))
+    return merged
+
+def block_sources(content: str) -> List[str]:
+    # Reference-style link definitions may live in any block, so each block is
+    # rendered (and hashed) together with all of them
+    references = "\n".join(REFERENCE_RE.findall(content or ""))
+    blocks = split_blocks(content)
+    if references:
+        blocks = [f"{block}\n\n{references}" for block in blocks]
+    return blocks
+
+def render_blocks(db: Session, sources: List[str]) -> List[Tuple[str, str]]:
+    """(hash, html) per block; only blocks missing from the render cache are rendered"""
+    hashes = [content_hash(source) for source in sources]
+    unique = list(dict.fromkeys(hashes))
+    cached: Dict[str, str] = {}
+    for i in range(0, len(unique), CACHE_LOOKUP_CHUNK):
+        chunk = unique[i:i + CACHE_LOOKUP_CHUNK]
+        cached.update(db.query(models.RenderCache.content_hash, models.RenderCache.html).filter(
+            models.RenderCache.content_hash.in_(chunk)
+        ).all())
+
+    rendered = {}
+    for digest, source in zip(hashes, sources):
+        if digest not in cached and digest not in rendered:
+            rendered[digest] = render_markdown(source)
+    if rendered:
+        try:
+            with db.begin_nested():
+                db.add_all(models.RenderCache(content_hash=h, html=html) for h, html in rendered.items())
+        except IntegrityError:
+            pass  # some blocks were rendered concurrently by another request
+        cached.update(rendered)
+        _count_inserts(db, len(rendered))
+    return [(digest, cached[digest]) for digest in hashes]
+
+def _count_inserts(db: Session, count: int):
+    # Render threads share the counter; exactly one of them runs each purge
+    global _inserted
+    with _inserted_lock:
+        _inserted += count
+        due = _inserted >= RENDER_CACHE_PURGE_EVERY
+        if due:
+            _inserted = 0
+    if due:
+        purge_render_cache(db)
+
+def purge_render_cache(db: Session, max_age: timedelta = RENDER_CACHE_MAX_AGE) -> int:
+    """Delete render_cache rows older than max_age (caller commits)"""
+    cutoff = datetime.utcnow() - max_age
+    if db.get_bind().dialect.name == "sqlite":  # server_default timestamps are stored as text
+        cutoff = cutoff.isoformat(sep=" ", timespec="seconds")
+    return db.query(models.RenderCache).filter(
+        models.RenderCache.created_at < cutoff
+    ).delete(synchronize_session=False)
+
+def dedupe_heading_ids(blocks: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Make heading ids unique across separately rendered blocks.
+
+    The toc extension only deduplicates within one conversion, so two
+    "## Intro" blocks both come back as id="intro". Later duplicates get
+    intro_1, intro_2, ... as a whole-document render would give them. A
+    block whose HTML changes gets a key derived from its hash and new HTML,
+    so the render diff never maps one key to two different HTML bodies.
+    """
+    ids = set()
+    result = []
+    for digest, html in blocks:
+        deduped = HEADING_ID_RE.sub(lambda m: m.group(1) + unique(m.group(2), ids) + m.group(3), html)
+        if deduped != html:
+            digest = hashlib.sha256(f"{digest}\0{deduped}".encode("utf-8")).hexdigest()
+        result.append((digest, deduped))
+    return result
+
+def render_post(db: Session, post: models.Post) -> Optional[dict]:
+    """
+    Refresh post.content_html if its content changed (caller commits).
+
+    Returns the block-level diff against the previous render - block hashes
+    in document order, HTML for blocks the previous render did not have, and
+    hashes that disappeared - or None when nothing changed.
+    """
+    digest = content_hash(post.content)
+    if post.content_hash == digest and post.content_html is not None:
+        return None
+    previous = json.loads(post.block_hashes) if post.block_hashes else []
+    blocks = dedupe_heading_ids(render_blocks(db, block_sources(post.content)))
+    order = [h for h, _ in blocks]
+
+    post.content_hash = digest
+    post.content_html = "\n".join(html for _, html in blocks)
+    post.block_hashes = json.dumps(order)
+
+    seen, current = set(previous), set(order)
+    return {
+        "order": order,
+        "changed": {h: html for h, html in blocks if h not in seen},
+        "removed": [h for h in dict.fromkeys(previous) if h not in current],
+    }
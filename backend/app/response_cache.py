@@ -0,0 +1,199 @@
+"""
+Response cache for public read endpoints
+Serialized GET responses with strong ETags, keyed by versioned invalidation tags
+"""
+
+import hashlib
+import json
+import os
+import re
+from typing import Callable, Iterable, List, Optional
+
+from starlette.requests import Request
+
+from .cache import CacheBackend, MemoryBackend, bump_tags, recently_bumped, shared_cache, tag_versions
+from .database import is_pinned, read_route
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "60"))
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Store response bodies in the CACHE_URL backend instead of per process
+RESPONSE_CACHE_SHARED = os.getenv("RESPONSE_CACHE_SHARED", "false").lower() == "true"
+
+
+class CacheEntry:
+    __slots__ = ("body", "etag", "headers", "meta")
+
+    def __init__(self, body: bytes, headers: list, meta: dict, etag: str = None):
+        self.body = body
+        self.etag = etag or '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        self.headers = headers
+        self.meta = meta
+
+    def pack(self) -> bytes:
+        header = {
+            "etag": self.etag,
+            "headers": [[k.decode("latin-1"), v.decode("latin-1")] for k, v in self.headers],
+            "meta": self.meta,
+        }
+        return json.dumps(header).encode() + b"\n" + self.body
+
+    @classmethod
+    def unpack(cls, data: bytes) -> "CacheEntry":
+        header, body = data.split(b"\n", 1)
+        header = json.loads(header)
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in header["headers"]]
+        return cls(body, headers, header["meta"], header["etag"])
+
+
+class ResponseCache:
+    """
+    Response store with per-entry TTL on top of a cache backend.
+
+    Keys embed the current versions of the entry's invalidation tags
+    ("posts", "post:<slug>", "comments:<post_id>", ...). Writes call
+    invalidate() with the tags they affect, which bumps those versions in
+    the shared backend, so every worker stops finding the old entries.
+    Versions are read before the response is built, so a response computed
+    across an invalidation is stored under a key nobody looks up.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = RESPONSE_CACHE_TTL):
+        self.backend = backend or MemoryBackend(RESPONSE_CACHE_SIZE, RESPONSE_CACHE_MAX_BYTES)
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, path: str, query: str, tags: Iterable[str]) -> str:
+        return f"resp:{path}?{query}#{tag_versions(tags)}"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        data = self.backend.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return CacheEntry.unpack(data)
+
+    def set(self, key: str, entry: CacheEntry):
+        self.backend.set(key, entry.pack(), self.ttl)
+
+    def stats(self) -> dict:
+        stats = {"hits": self.hits, "misses": self.misses, "shared": self.backend.shared}
+        if isinstance(self.backend, MemoryBackend):
+            stats.update(self.backend.stats())
+        return stats
+
+
+response_cache = ResponseCache(shared_cache if RESPONSE_CACHE_SHARED else None)
+
+def invalidate(*tags: str):
+    bump_tags(*tags)
+
+def post_tags(post) -> List[str]:
+    """Tags covering every cached response that shows this post"""
+    return ["posts", f"post:{post.id}", f"post:{post.slug}"]
+
+# ==================== ROUTES ====================
+
+class CacheRule:
+    def __init__(self, pattern: str, tags: Callable[[dict], Iterable[str]],
+                 on_store: Optional[Callable[[bytes], dict]] = None):
+        self.pattern = re.compile(pattern)
+        self.tags = tags
+        self.on_store = on_store
+
+
+def _post_meta(body: bytes) -> dict:
+    return {"post_id": json.loads(body).get("id")}
+
+CACHE_RULES = [
+    CacheRule(r"^/api/posts$", lambda m: ["posts"]),
+    CacheRule(r"^/api/posts/(?P<post_id>[^/]+)/comments$", lambda m: [f"comments:{m['post_id']}"]),
+    CacheRule(r"^/api/posts/(?P<slug>[^/]+)$", lambda m: ["posts", f"post:{m['slug']}"], _post_meta),
+    CacheRule(r"^/api/categories$", lambda m: ["categories"]),
+    CacheRule(r"^/api/tags$", lambda m: ["tags"]),
+    CacheRule(r"^/api/taxonomy/counts$", lambda m: ["categories", "tags"]),
+]
+
+def _match(path: str):
+    for rule in CACHE_RULES:
+        match = rule.pattern.match(path)
+        if match:
+            return rule, match.groupdict()
+    return None, None
+
+
+class ResponseCacheMiddleware:
+    """
+    ASGI middleware serving cached GET responses for CACHE_RULES routes.
+
+    Hits are answered without entering FastAPI routing, SQLAlchemy or
+    Pydantic. Requests whose If-None-Match matches get 304 Not Modified.
+    `on_hit(path, entry)` lets the app keep side effects such as view counting.
+
+    With read replicas, a client pinned to the primary after a write skips
+    the lookup (an entry may have been filled from a lagging replica), and a
+    replica-served response is not stored while its tags were just bumped.
+    """
+
+    def __init__(self, app, cache: ResponseCache = response_cache,
+                 on_hit: Optional[Callable[[str, CacheEntry], None]] = None):
+        self.app = app
+        self.cache = cache
+        self.on_hit = on_hit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "GET":
+            return await self.app(scope, receive, send)
+        rule, params = _match(scope["path"])
+        if rule is None:
+            return await self.app(scope, receive, send)
+
+        query = "&".join(sorted(scope.get("query_string", b"").decode("latin-1").split("&")))
+        tags = list(rule.tags(params))
+        key = self.cache.key(scope["path"], query, tags)
+        if_none_match = dict(scope["headers"]).get(b"if-none-match", b"").decode("latin-1")
+
+        entry = None if is_pinned(Request(scope)) else self.cache.get(key)
+        if entry is not None:
+            if self.on_hit:
+                self.on_hit(scope["path"], entry)
+            return await self._send(send, entry, if_none_match, b"HIT")
+
+        start = {}
+        chunks = []
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                start.update(message)
+            elif message["type"] == "http.response.body":
+                chunks.append(message.get("body", b""))
+
+        await self.app(scope, receive, capture)
+        body = b"".join(chunks)
+        if start.get("status") != 200:
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+            return
+        headers = [(k, v) for k, v in start.get("headers", []) if k.lower() not in (b"content-length", b"etag")]
+        entry = CacheEntry(body, headers, rule.on_store(body) if rule.on_store else {})
+        if not (read_route(Request(scope)) == "replica" and recently_bumped(tags)):
+            self.cache.set(key, entry)
+        await self._send(send, entry, if_none_match, b"MISS")
+
+    async def _send(self, send, entry: CacheEntry, if_none_match: str, state: bytes):
+        headers = entry.headers + [
+            (b"etag", entry.etag.encode()),
+            (b"cache-control", b"public, no-cache"),
+            (b"x-cache", state),
+        ]
+        if if_none_match and entry.etag in [t.strip() for t in if_none_match.split(",")]:
+            await send({"type": "http.response.start", "status": 304,
+                        "headers": [(k, v) for k, v in headers if k.lower() != b"content-type"]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": headers + [(b"content-length", str(len(entry.body)).encode())]})
+        await send({"type": "http.response.body", "body": entry.body})
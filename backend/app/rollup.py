@@ -0,0 +1,239 @@
+"""
+Analytics rollup job
+Folds new page_views rows into the hourly/daily rollup tables incrementally
+"""
+
+import logging
+import os
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+from sqlalchemy import func, inspect, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from . import models
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "true").lower() == "true"
+ROLLUP_INTERVAL_SECONDS = float(os.getenv("ROLLUP_INTERVAL", "60"))
+# The watermark is on ingested_at, which the database stamps at insert time;
+# rows younger than this (by the database clock) are left for the next run so
+# insert transactions still open when a window is claimed are not skipped
+ROLLUP_GRACE_SECONDS = float(os.getenv("ROLLUP_GRACE", "30"))
+# page_views rows without ingested_at (written before it existed) handled per transaction
+BACKFILL_BATCH = int(os.getenv("ROLLUP_BACKFILL_BATCH", "5000"))
+
+STATE_NAME = "page_views"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _utc(value: datetime) -> datetime:
+    """
+    Aware UTC datetime. PostgreSQL returns timestamptz values in the
+    session's time zone; SQLite returns naive values, stored as UTC.
+    """
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def referrer_host(referrer) -> str:
+    """Collapse a referrer URL to its host; "" for direct traffic"""
+    if not referrer:
+        return ""
+    host = urlparse(referrer).netloc or referrer
+    return host.lower().removeprefix("www.")[:255]
+
+def _add(db: Session, model, key: dict, views: int):
+    # Portable upsert: bump an existing rollup row, insert it otherwise
+    query = db.query(model).filter_by(**key)
+    if not query.update({model.views: model.views + views}, synchronize_session=False):
+        db.add(model(**key, views=views))
+
+def _watermark(db: Session) -> datetime:
+    # Current watermark, creating the state row on first use
+    state = db.get(models.RollupState, STATE_NAME)
+    if state is None:
+        try:
+            db.add(models.RollupState(name=STATE_NAME, watermark=EPOCH))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+        state = db.get(models.RollupState, STATE_NAME)
+    return _utc(state.watermark)
+
+def _claim_window(db: Session, upper: datetime):
+    """
+    Advance the watermark to `upper` and return the previous one.
+
+    The conditional UPDATE is the first statement of the transaction, so
+    concurrent runs from other workers serialize on the state row and only
+    one of them gets to fold a given window.
+    """
+    lower = _watermark(db)
+    db.rollback()
+    if lower >= upper:
+        return None
+    claimed = db.query(models.RollupState).filter(
+        models.RollupState.name == STATE_NAME,
+        models.RollupState.watermark == lower
+    ).update({models.RollupState.watermark: upper}, synchronize_session=False)
+    return lower if claimed else None
+
+def _database_now(db: Session) -> datetime:
+    now = db.query(func.now()).scalar()
+    db.rollback()
+    return _utc(now)
+
+def _fold(db: Session, rows) -> int:
+    """Add (post_id, viewed_at, referrer, country) rows to the rollups; returns rows folded"""
+    hourly = Counter()
+    daily = Counter()
+    folded = 0
+    for post_id, viewed_at, referrer, country in rows:
+        if post_id is None or viewed_at is None:
+            continue
+        viewed_at = _utc(viewed_at).replace(tzinfo=None)  # buckets are naive UTC
+        dims = (str(post_id), referrer_host(referrer), (country or "").upper())
+        hourly[(viewed_at.replace(minute=0, second=0, microsecond=0),) + dims] += 1
+        daily[(viewed_at.date(),) + dims] += 1
+        folded += 1
+
+    for (bucket, post_id, referrer, country), views in hourly.items():
+        _add(db, models.PageViewHourly, {"bucket": bucket, "post_id": post_id, "referrer": referrer, "country": country}, views)
+    for (day, post_id, referrer, country), views in daily.items():
+        _add(db, models.PageViewDaily, {"day": day, "post_id": post_id, "referrer": referrer, "country": country}, views)
+    return folded
+
+def backfill_ingested_at(db: Session, batch: int = BACKFILL_BATCH) -> int:
+    """
+    Stamp page views that have no ingested_at (written before the column
+    existed, or on a SQLite table it was added to without a default) with
+    their viewed_at; returns rows folded.
+
+    Each batch first locks the state row, like _claim_window. Rows the
+    watermark has already passed are folded here, since no window will
+    cover them; the rest fall in the next window.
+    """
+    folded = 0
+    _watermark(db)
+    db.rollback()
+    while True:
+        db.query(models.RollupState).filter(models.RollupState.name == STATE_NAME).update(
+            {models.RollupState.watermark: models.RollupState.watermark}, synchronize_session=False
+        )
+        watermark = _utc(db.query(models.RollupState.watermark).filter(models.RollupState.name == STATE_NAME).scalar())
+        rows = db.query(
+            models.PageView.id,
+            models.PageView.post_id,
+            models.PageView.viewed_at,
+            models.PageView.referrer,
+            models.PageView.country
+        ).filter(models.PageView.ingested_at.is_(None)).limit(batch).all()
+        if not rows:
+            db.rollback()
+            return folded
+        db.query(models.PageView).filter(models.PageView.id.in_([row.id for row in rows])).update(
+            {models.PageView.ingested_at: func.coalesce(models.PageView.viewed_at, EPOCH)}, synchronize_session=False
+        )
+        folded += _fold(db, [
+            (row.post_id, row.viewed_at, row.referrer, row.country) for row in rows
+            if row.viewed_at is not None and _utc(row.viewed_at) <= watermark
+        ])
+        db.commit()
+
+def ensure_ingested_at(engine: Engine):
+    """Add page_views.ingested_at (and its index) to databases created before it existed"""
+    if "ingested_at" in {column["name"] for column in inspect(engine).get_columns("page_views")}:
+        return
+    with engine.begin() as connection:
+        if engine.dialect.name == "postgresql":
+            # Existing rows stay NULL for backfill_ingested_at; new ones get the insert time
+            connection.execute(text("ALTER TABLE page_views ADD COLUMN ingested_at TIMESTAMP WITH TIME ZONE"))
+            connection.execute(text("ALTER TABLE page_views ALTER COLUMN ingested_at SET DEFAULT now()"))
+        else:
+            # SQLite cannot add a column with a non-constant default: every row is backfilled
+            connection.execute(text("ALTER TABLE page_views ADD COLUMN ingested_at DATETIME"))
+        connection.execute(text("CREATE INDEX IF NOT EXISTS ix_page_views_ingested_at ON page_views (ingested_at)"))
+
+def run_rollup(db: Session, now: datetime = None) -> int:
+    """
+    Fold page views ingested before the grace period into the rollups; returns rows folded.
+
+    Windows are claimed on ingested_at, not viewed_at: a view queued long
+    before it was written (queue backlog, slow batch, app clock skew) still
+    falls in a later window, while it is bucketed by when it happened.
+    Rows without ingested_at are backfilled first.
+    """
+    folded = backfill_ingested_at(db)
+    upper = (now or _database_now(db)) - timedelta(seconds=ROLLUP_GRACE_SECONDS)
+    lower = _claim_window(db, upper)
+    if lower is None:
+        db.rollback()
+        return folded
+
+    rows = db.query(
+        models.PageView.post_id,
+        models.PageView.viewed_at,
+        models.PageView.referrer,
+        models.PageView.country
+    ).filter(
+        models.PageView.ingested_at > lower,
+        models.PageView.ingested_at <= upper
+    ).yield_per(1000)
+    folded += _fold(db, rows)
+    db.commit()
+    return folded
+
+
+class RollupWorker:
+    """Runs the rollup job on a background thread"""
+
+    def __init__(self, interval: float = ROLLUP_INTERVAL_SECONDS):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self) -> int:
+        db = SessionLocal()
+        try:
+            return run_rollup(db)
+        except Exception:
+            logger.exception("Analytics rollup failed")
+            db.rollback()
+            return 0
+        finally:
+            db.close()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.run_once()
+
+    def start(self):
+        if ROLLUP_ENABLED and (self._thread is None or not self._thread.is_alive()):
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="analytics-rollup", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+
+rollup_worker = RollupWorker()
+
+
+if __name__ == "__main__":
+    from .database import Base, engine
+
+    Base.metadata.create_all(bind=engine)
+    ensure_ingested_at(engine)
+    print(f"✅ Folded {rollup_worker.run_once()} page views into rollups")
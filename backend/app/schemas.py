@@ -1,7 +1,7 @@
 """Pydantic schemas for request/response validation"""
 
 from pydantic import BaseModel, EmailStr, validator
-from typing import Optional, List
+from typing import Optional, List, Dict
 from datetime import datetime
 from uuid import UUID
 
@@ -33,8 +33,9 @@ class PostBase(BaseModel):
     status: str = "draft"
 
 class PostCreate(PostBase):
-    content_mdx: str
-    reading_time: Optional[int]
+    content_mdx: Optional[str] = None  # defaults to the Markdown source
+    category_ids: List[UUID] = []
+    tag_ids: List[UUID] = []
 
 class PostUpdate(BaseModel):
     title: Optional[str]
@@ -42,21 +43,68 @@ class PostUpdate(BaseModel):
     excerpt: Optional[str]
     status: Optional[str]
     featured_image: Optional[str]
+    category_ids: Optional[List[UUID]] = None
+    tag_ids: Optional[List[UUID]] = None
 
 class Post(PostBase):
     id: UUID
     author_id: UUID
     views_count: int
+    reading_time: Optional[int] = None
+    average_rating: float = 0.0
+    rating_count: int = 0
     created_at: datetime
     published_at: Optional[datetime]
 
     class Config:
         from_attributes = True
 
+class TocEntry(BaseModel):
+    level: int
+    id: str
+    title: str
+
 class PostDetail(Post):
     author: User
     categories: List['Category']
     tags: List['Tag']
+    toc: List[TocEntry] = []
+
+class RenderDiff(BaseModel):
+    order: List[str]  # block hashes in document order
+    changed: Dict[str, str]  # block hash -> HTML, for blocks new in this render
+    removed: List[str]
+
+class PostUpdateResult(Post):
+    render_diff: Optional[RenderDiff] = None
+
+class PostSummary(BaseModel):
+    """Listing card: a post without its Markdown body"""
+    id: UUID
+    title: str
+    slug: str
+    excerpt: Optional[str]
+    featured_image: Optional[str]
+    status: str
+    author_id: UUID
+    views_count: int
+    reading_time: Optional[int] = None
+    average_rating: float = 0.0
+    rating_count: int = 0
+    created_at: datetime
+    published_at: Optional[datetime]
+
+    class Config:
+        from_attributes = True
+
+class PostPage(BaseModel):
+    items: List[PostSummary]
+    next_cursor: Optional[str] = None
+
+class SearchResults(BaseModel):
+    total: int
+    results: List[PostSummary]
+    next_cursor: Optional[str] = None
 
 # Comment Schemas
 class CommentCreate(BaseModel):
@@ -76,6 +124,43 @@ class Comment(BaseModel):
     class Config:
         from_attributes = True
 
+class CommentPage(BaseModel):
+    items: List[Comment]
+    next_cursor: Optional[str] = None
+
+class CommentModeration(BaseModel):
+    """Bulk moderation: comments matching `ids` and/or every given filter"""
+    action: str  # approve, reject, delete
+    ids: Optional[List[UUID]] = None
+    post_id: Optional[UUID] = None
+    author_email: Optional[str] = None
+    created_before: Optional[datetime] = None
+    status: Optional[str] = None
+
+    @validator('action')
+    def validate_action(cls, v):
+        if v not in ('approve', 'reject', 'delete'):
+            raise ValueError('Action must be approve, reject or delete')
+        return v
+
+    @validator('ids')
+    def validate_ids(cls, v):
+        if v is not None and len(v) > 1000:
+            raise ValueError('At most 1000 ids per request')
+        return v
+
+class CommentModerationResult(BaseModel):
+    action: str
+    affected: int
+
+class CommentThread(Comment):
+    parent_id: Optional[UUID] = None
+    replies: List["CommentThread"] = []
+
+class CommentThreadPage(BaseModel):
+    items: List[CommentThread]
+    next_cursor: Optional[str] = None
+
 # Rating Schema
 class RatingCreate(BaseModel):
     user_ip: str
@@ -103,6 +188,7 @@ class CategoryCreate(BaseModel):
 
 class Category(CategoryCreate):
     id: UUID
+    post_count: int = 0
     created_at: datetime
 
     class Config:
@@ -115,11 +201,16 @@ class TagCreate(BaseModel):
 
 class Tag(TagCreate):
     id: UUID
+    post_count: int = 0
     created_at: datetime
 
     class Config:
         from_attributes = True
 
+class TaxonomyCounts(BaseModel):
+    categories: Dict[str, int]
+    tags: Dict[str, int]
+
 # Media Schema
 class MediaCreate(BaseModel):
     filename: str
@@ -138,6 +229,10 @@ class Media(MediaCreate):
     class Config:
         from_attributes = True
 
+class MediaPage(BaseModel):
+    items: List[Media]
+    next_cursor: Optional[str] = None
+
 # Analytics Schema
 class PageViewCreate(BaseModel):
     post_id: UUID
@@ -0,0 +1,301 @@
+"""
+Full-text search index for posts
+Hebrew/Latin tokenizer, inverted index tables and BM25 ranking
+"""
+
+import json
+import math
+import os
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from typing import Dict, List, Set, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+from . import models
+from .cache import MemoryBackend, tag_versions
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Field weights - a term in the title counts as much as three in the body
+FIELD_WEIGHTS = (("title", 3), ("excerpt", 2), ("content", 1))
+
+MAX_TERM_LENGTH = 64
+# search_terms rows upserted per statement
+TERM_BATCH = 500
+
+# Final letters are folded to their regular forms (ך→כ, ם→מ, ן→נ, ף→פ, ץ→צ)
+FINAL_LETTERS = str.maketrans("ךםןףץ", "כמנפצ")
+
+# One-letter prefixes that attach to Hebrew words (ו, ה, ב, כ, ל, מ, ש)
+HEBREW_PREFIXES = set("והבכלמש")
+MAX_PREFIX_LENGTH = 3
+# Two-letter stems (לב in כלב, לך in הלך) match too many unrelated words
+MIN_STEM_LENGTH = 3
+
+# Query-time limits, so the cost of a keystroke does not grow with the corpus
+MIN_PREFIX_LENGTH = 2  # a shorter last word only matches exactly
+PREFIX_EXPANSIONS = int(os.getenv("SEARCH_PREFIX_EXPANSIONS", "50"))
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+SEARCH_RANK_TTL = float(os.getenv("SEARCH_RANK_TTL", "60"))
+
+rank_cache = MemoryBackend(max_entries=512)
+
+TOKEN_RE = re.compile(r"[^\W_]+")
+HEBREW_RE = re.compile(r"[א-ת]")
+# Geresh/gershayim inside abbreviations (צה"ל, ג'ירפה) are part of the word
+GERESH_RE = re.compile(r"(?<=[א-ת])['\"׳״](?=[א-ת])")
+
+# ==================== TOKENIZER ====================
+
+def normalize(text: str) -> str:
+    """Strip niqqud, cantillation and accents, fold final letters and case"""
+    text = GERESH_RE.sub("", text)
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    return text.translate(FINAL_LETTERS).casefold()
+
+def tokenize(text: str) -> List[str]:
+    """Split text into normalized word tokens"""
+    if not text:
+        return []
+    return [t for t in TOKEN_RE.findall(normalize(text)) if len(t) <= MAX_TERM_LENGTH]
+
+def term_variants(token: str) -> List[str]:
+    """Return the token plus its forms with common Hebrew prefixes removed"""
+    variants = [token]
+    if not HEBREW_RE.match(token):
+        return variants
+    for i in range(1, MAX_PREFIX_LENGTH + 1):
+        if token[i - 1] not in HEBREW_PREFIXES or len(token) - i < MIN_STEM_LENGTH:
+            break
+        variants.append(token[i:])
+    return variants
+
+def document_terms(post: models.Post) -> Tuple[Counter, Set[str], int]:
+    """Weighted term frequencies, the terms written as-is, and document length for a post"""
+    terms = Counter()
+    surface = set()
+    length = 0
+    for field, weight in FIELD_WEIGHTS:
+        tokens = tokenize(getattr(post, field) or "")
+        length += len(tokens) * weight
+        surface.update(tokens)
+        for token in tokens:
+            for term in term_variants(token):
+                terms[term] += weight
+    return terms, surface, length
+
+# ==================== INDEX MAINTENANCE ====================
+
+SEARCH_TABLES = [
+    models.SearchPosting.__table__,
+    models.SearchDocument.__table__,
+    models.SearchTerm.__table__,
+    models.SearchStats.__table__,
+]
+
+def _insert(db: Session):
+    # INSERT ... ON CONFLICT, so concurrent writers add to the counters atomically
+    return (postgresql if db.get_bind().dialect.name == "postgresql" else sqlite).insert
+
+def _add_term_counts(db: Session, deltas: Dict[str, Tuple[int, int]]):
+    """Add (documents, surface_documents) deltas to search_terms, in term order to avoid deadlocks"""
+    table = models.SearchTerm.__table__
+    items = sorted(deltas.items())
+    for start in range(0, len(items), TERM_BATCH):
+        statement = _insert(db)(table).values([
+            {"term": term, "documents": documents, "surface_documents": surface}
+            for term, (documents, surface) in items[start:start + TERM_BATCH]
+        ])
+        db.execute(statement.on_conflict_do_update(index_elements=[table.c.term], set_={
+            "documents": table.c.documents + statement.excluded.documents,
+            "surface_documents": table.c.surface_documents + statement.excluded.surface_documents,
+        }))
+
+def _add_document_counts(db: Session, documents: int, length: int):
+    table = models.SearchStats.__table__
+    statement = _insert(db)(table).values(id=1, documents=documents, total_length=length)
+    db.execute(statement.on_conflict_do_update(index_elements=[table.c.id], set_={
+        "documents": table.c.documents + statement.excluded.documents,
+        "total_length": table.c.total_length + statement.excluded.total_length,
+    }))
+
+def remove_post(db: Session, post_id: str):
+    """Drop a post from the index (caller commits)"""
+    length = db.query(models.SearchDocument.length).filter(models.SearchDocument.post_id == post_id).scalar()
+    if length is None:
+        return  # not indexed
+    postings = db.query(models.SearchPosting.term, models.SearchPosting.surface).filter(
+        models.SearchPosting.post_id == post_id
+    ).all()
+    _add_term_counts(db, {term: (-1, -int(surface)) for term, surface in postings})
+    _add_document_counts(db, -1, -length)
+    db.query(models.SearchPosting).filter(models.SearchPosting.post_id == post_id).delete(synchronize_session=False)
+    db.query(models.SearchDocument).filter(models.SearchDocument.post_id == post_id).delete(synchronize_session=False)
+
+def index_post(db: Session, post: models.Post):
+    """(Re)index a post; only published posts are searchable (caller commits)"""
+    remove_post(db, post.id)
+    if post.status != "published":
+        return
+    terms, surface, length = document_terms(post)
+    db.bulk_insert_mappings(models.SearchDocument, [{"post_id": post.id, "length": length}])
+    db.bulk_insert_mappings(models.SearchPosting, [
+        {"term": term, "post_id": post.id, "frequency": frequency, "surface": term in surface}
+        for term, frequency in terms.items()
+    ])
+    _add_term_counts(db, {term: (1, int(term in surface)) for term in terms})
+    _add_document_counts(db, 1, length)
+
+def rebuild_index(db: Session):
+    """
+    Reindex every post - used after deploying the index on an existing
+    database. The search tables are recreated, so this also applies
+    changes to their schema.
+    """
+    db.commit()
+    models.Base.metadata.drop_all(bind=db.get_bind(), tables=SEARCH_TABLES)
+    models.Base.metadata.create_all(bind=db.get_bind(), tables=SEARCH_TABLES)
+    for post in db.query(models.Post).filter(models.Post.status == "published").yield_per(100):
+        index_post(db, post)
+    db.commit()
+
+# ==================== QUERY ====================
+
+def _prefix_upper_bound(prefix: str) -> str:
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+def _completions(db: Session, prefix: str) -> List[str]:
+    """
+    Terms starting with prefix that some post contains as written, at most
+    PREFIX_EXPANSIONS of them. Prefix-stripped forms are left out: לבים
+    (from הכלבים) must not complete לב.
+    """
+    if len(prefix) < MIN_PREFIX_LENGTH:
+        return []
+    rows = db.query(models.SearchTerm.term).filter(
+        models.SearchTerm.term >= prefix,
+        models.SearchTerm.term < _prefix_upper_bound(prefix),
+        models.SearchTerm.surface_documents > 0
+    ).order_by(models.SearchTerm.term).limit(PREFIX_EXPANSIONS).all()
+    return [term for term, in rows]
+
+def rank(db: Session, query: str, prefix_last: bool = True) -> List[Tuple[str, float]]:
+    """
+    Rank published posts against a query with BM25.
+
+    Every query word must match (AND). Words are looked up as typed - the
+    index already holds every word's prefix-stripped forms, so stripping the
+    query too would pair unrelated words sharing a stem. The last word also
+    matches as a prefix (from MIN_PREFIX_LENGTH letters) so results update
+    while the user is still typing; completions only match posts containing
+    them as written.
+
+    Document frequencies and corpus statistics are read from counters kept
+    by index_post, and candidate posts are chosen in SQL, driven by the
+    rarest word and capped at SEARCH_MAX_CANDIDATES, so no query step scans
+    the whole index. Returns (post_id, score) pairs, best first.
+    """
+    tokens = list(dict.fromkeys(tokenize(query)))
+    if not tokens:
+        return []
+    completions = []
+    if prefix_last:
+        completions = [t for t in _completions(db, tokens[-1]) if t != tokens[-1]]
+
+    posting = models.SearchPosting
+    counts = {term: (documents, surface) for term, documents, surface in db.query(
+        models.SearchTerm.term, models.SearchTerm.documents, models.SearchTerm.surface_documents
+    ).filter(models.SearchTerm.term.in_(tokens + completions)).all()}
+    # A completion that is also a query word counts (and matches) as that word
+    document_frequency = {t: counts[t][1] for t in completions if t in counts}
+    document_frequency.update({t: counts[t][0] for t in tokens if t in counts})
+
+    def word_matches(i: int):
+        condition = posting.term == tokens[i]
+        if i == len(tokens) - 1 and completions:
+            condition = or_(condition, and_(posting.term.in_(completions), posting.surface))
+        return condition
+
+    word_frequency = [document_frequency.get(token, 0) for token in tokens]
+    word_frequency[-1] += sum(counts[t][1] for t in completions if t in counts)
+    if not all(word_frequency):
+        return []
+
+    driver = min(range(len(tokens)), key=word_frequency.__getitem__)
+    candidate_query = db.query(posting.post_id).filter(word_matches(driver))
+    for i in range(len(tokens)):
+        if i != driver:
+            candidate_query = candidate_query.filter(
+                posting.post_id.in_(select(posting.post_id).where(word_matches(i)))
+            )
+    candidates = [post_id for post_id, in candidate_query.group_by(posting.post_id).order_by(
+        func.sum(posting.frequency).desc(), posting.post_id
+    ).limit(SEARCH_MAX_CANDIDATES).all()]
+    if not candidates:
+        return []
+
+    term_hits: Dict[str, List[Tuple[str, int]]] = defaultdict(list)
+    for term, post_id, frequency in db.query(posting.term, posting.post_id, posting.frequency).filter(
+        or_(posting.term.in_(tokens), and_(posting.term.in_(completions), posting.surface)),
+        posting.post_id.in_(candidates)
+    ).all():
+        term_hits[post_id].append((term, frequency))
+
+    stats = db.query(models.SearchStats.documents, models.SearchStats.total_length).filter(
+        models.SearchStats.id == 1
+    ).first()
+    total_docs = stats.documents if stats else 0
+    average_length = (stats.total_length / stats.documents if stats and stats.documents > 0 else 0) or 1.0
+    lengths = dict(db.query(models.SearchDocument.post_id, models.SearchDocument.length).filter(
+        models.SearchDocument.post_id.in_(candidates)
+    ).all())
+
+    scores = []
+    for post_id in candidates:
+        length = lengths.get(post_id, average_length)
+        score = 0.0
+        for term, frequency in term_hits[post_id]:
+            df = document_frequency[term]
+            idf = math.log(1 + (max(total_docs, df) - df + 0.5) / (df + 0.5))
+            score += idf * frequency * (K1 + 1) / (frequency + K1 * (1 - B + B * length / average_length))
+        scores.append((post_id, score))
+
+    scores.sort(key=lambda item: (-item[1], item[0]))
+    return scores
+
+def cached_rank(db: Session, query: str) -> List[Tuple[str, float]]:
+    """
+    rank(), kept per version of the "posts" tag so paging through results
+    ranks once. Every post write bumps that tag; the TTL bounds staleness
+    for writes made by other workers.
+    """
+    key = f"rank:{tag_versions(['posts'])}:{normalize(query).strip()}"
+    cached = rank_cache.get(key)
+    if cached is not None:
+        return [tuple(item) for item in json.loads(cached)]
+    ranked = rank(db, query)
+    rank_cache.set(key, json.dumps(ranked).encode(), SEARCH_RANK_TTL)
+    return ranked
+
+def matching_post_ids(db: Session, query: str) -> List[str]:
+    """Ids of published posts matching every word of the query"""
+    return [post_id for post_id, _ in rank(db, query)]
+
+
+if __name__ == "__main__":
+    from .database import Base, SessionLocal, engine
+
+    Base.metadata.create_all(bind=engine)
+    session = SessionLocal()
+    try:
+        rebuild_index(session)
+        print("✅ Search index rebuilt")
+    finally:
+        session.close()
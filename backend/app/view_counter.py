@@ -0,0 +1,97 @@
+"""
+Write-behind post view counter
+Aggregates view increments in memory and flushes them to the database in batches
+"""
+
+import logging
+import os
+import threading
+from collections import Counter
+from typing import Dict
+
+from .database import SessionLocal
+from . import crud
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_SECONDS = float(os.getenv("VIEW_FLUSH_INTERVAL", "5"))
+SHARDS = int(os.getenv("VIEW_COUNTER_SHARDS", "16"))
+
+
+class ViewCounterBuffer:
+    """
+    Per-process buffer of pending view increments.
+
+    Increments land in one of several lock-protected shards so concurrent
+    readers of different posts don't serialize on a single lock. A background
+    thread periodically swaps the shards out and writes one
+    `views_count = views_count + n` UPDATE per post, in a single transaction.
+    Each uvicorn worker keeps its own buffer and flushes independently.
+    """
+
+    def __init__(self, shards: int = SHARDS, interval: float = FLUSH_INTERVAL_SECONDS):
+        self.interval = interval
+        self._shards = [(threading.Lock(), Counter()) for _ in range(max(1, shards))]
+        self._stop = threading.Event()
+        self._thread = None
+        self._flush_lock = threading.Lock()
+
+    def record(self, post_id: str, n: int = 1):
+        lock, counts = self._shards[hash(post_id) % len(self._shards)]
+        with lock:
+            counts[post_id] += n
+
+    def pending(self) -> Dict[str, int]:
+        total = Counter()
+        for lock, counts in self._shards:
+            with lock:
+                total.update(counts)
+        return dict(total)
+
+    def _drain(self) -> Counter:
+        drained = Counter()
+        for lock, counts in self._shards:
+            with lock:
+                drained.update(counts)
+                counts.clear()
+        return drained
+
+    def flush(self) -> int:
+        """Write pending increments; on failure they are put back for the next flush"""
+        with self._flush_lock:
+            drained = self._drain()
+            if not drained:
+                return 0
+            db = SessionLocal()
+            try:
+                crud.add_post_views(db, drained)
+            except Exception:
+                logger.exception("Failed to flush %d buffered post views", sum(drained.values()))
+                db.rollback()
+                for post_id, n in drained.items():
+                    self.record(post_id, n)
+                return 0
+            finally:
+                db.close()
+            return len(drained)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="view-counter-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write whatever is still buffered"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+
+view_counter = ViewCounterBuffer()
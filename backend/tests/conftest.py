@@ -0,0 +1,62 @@
+"""
+Shared fixtures: the app on a throwaway SQLite database, response cache off
+
+    cd backend && python -m pytest
+"""
+
+import os
+import sys
+import tempfile
+import uuid
+from pathlib import Path
+
+# Configuration is read at import time, so it is set before the app is imported
+_DB_DIR = tempfile.mkdtemp(prefix="blog-tests-")
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{_DB_DIR}/test.db")
+os.environ.setdefault("RESPONSE_CACHE_ENABLED", "false")
+os.environ.setdefault("PASSWORD_BCRYPT_ROUNDS", "4")
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(scope="session")
+def app():
+    from app.main import app
+    return app
+
+@pytest.fixture(scope="session")
+def client(app):
+    with TestClient(app) as test_client:
+        yield test_client
+
+@pytest.fixture
+def db(app):
+    from app.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+@pytest.fixture
+def author(db):
+    from app import crud, schemas
+
+    name = f"author-{uuid.uuid4().hex[:8]}"
+    return crud.create_user(db, schemas.UserCreate(email=f"{name}@example.com", username=name, password="secret"))
+
+@pytest.fixture
+def make_post(db, author):
+    from app import crud, schemas
+
+    def make(content: str, status: str = "published", **fields):
+        slug = fields.pop("slug", f"post-{uuid.uuid4().hex[:8]}")
+        return crud.create_post(db, schemas.PostCreate(
+            title=fields.pop("title", slug), slug=slug, excerpt=None, content=content,
+            featured_image=None, status=status, **fields
+        ), author_id=author.id)
+
+    return make
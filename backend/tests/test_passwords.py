@@ -0,0 +1,26 @@
+import asyncio
+import os
+import signal
+
+import pytest
+
+from app.passwords import PasswordHashPool, PasswordPoolBroken, pwd_context
+
+
+def test_pool_recovers_after_worker_is_killed():
+    pool = PasswordHashPool(workers=1, max_pending=4)
+
+    async def scenario():
+        assert pwd_context.verify("first", await pool.hash("first"))
+        for pid in list(pool._executor._processes):
+            os.kill(pid, signal.SIGKILL)
+        with pytest.raises(PasswordPoolBroken):
+            await pool.hash("lost")
+        return await pool.hash("second")
+
+    try:
+        assert pwd_context.verify("second", asyncio.run(scenario()))
+        assert pool.metrics()["restarts"] == 1
+        assert pool.pending == 0
+    finally:
+        pool.shutdown()
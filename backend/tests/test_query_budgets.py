@@ -0,0 +1,61 @@
+"""
+Per-endpoint SQL query budgets (querycount.QUERY_BUDGETS), so N+1 regressions fail the suite.
+
+ASYNC_DATABASE is read when the app is imported: the budgets are checked in
+this process's mode and again in a child process for the other one.
+"""
+
+import os
+import subprocess
+import sys
+import uuid
+from pathlib import Path
+
+from app import crud, schemas
+from app.database import ASYNC_DATABASE
+from app.querycount import QUERY_BUDGETS, assert_endpoint_budget
+
+
+def test_endpoint_budgets(client, db, make_post):
+    suffix = uuid.uuid4().hex[:8]
+    category = crud.create_category(db, schemas.CategoryCreate(name=f"c-{suffix}", slug=f"c-{suffix}", description=None))
+    tag = crud.create_tag(db, schemas.TagCreate(name=f"t-{suffix}", slug=f"t-{suffix}"))
+    post = make_post("# Title\n\nBody text.", category_ids=[category.id], tag_ids=[tag.id])
+    make_post("Second post.")
+    parent = crud.create_comment(db, schemas.CommentCreate(
+        author_name="Reader", author_email="reader@example.com", content="First!", parent_id=None
+    ), post.id)
+    reply = crud.create_comment(db, schemas.CommentCreate(
+        author_name="Author", author_email="author@example.com", content="Thanks", parent_id=parent.id
+    ), post.id)
+    crud.moderate_comments(db, schemas.CommentModeration(action="approve", ids=[parent.id, reply.id]))
+
+    urls = {
+        "/api/posts/{slug}": f"/api/posts/{post.slug}",
+        "/api/posts/{post_id}/comments": f"/api/posts/{post.id}/comments",
+    }
+    responses = {}
+    for key in QUERY_BUDGETS:
+        method, route = key.split(" ", 1)
+        response = assert_endpoint_budget(client, method, route, urls.get(route))
+        assert response.status_code == 200, (key, response.text)
+        responses[route] = response.json()
+
+    # The budgets only mean something if the related rows were really serialized
+    detail = responses["/api/posts/{slug}"]
+    assert [c["slug"] for c in detail["categories"]] == [category.slug]
+    assert [t["slug"] for t in detail["tags"]] == [tag.slug]
+    assert detail["author"]["id"] == str(post.author_id)
+    [thread] = responses["/api/posts/{post_id}/comments"]["items"]
+    assert [r["content"] for r in thread["replies"]] == ["Thanks"]
+    assert len(responses["/api/posts"]["items"]) >= 2
+
+
+def test_endpoint_budgets_other_async_mode():
+    env = {**os.environ, "ASYNC_DATABASE": "false" if ASYNC_DATABASE else "true"}
+    env.pop("DATABASE_URL", None)  # a fresh database for the child process
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider", f"{__file__}::test_endpoint_budgets"],
+        cwd=Path(__file__).resolve().parents[1], env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0, result.stdout[-4000:] + result.stderr[-2000:]
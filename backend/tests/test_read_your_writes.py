@@ -0,0 +1,94 @@
+"""
+Read-your-writes routing. The replica tests run in a child process, since
+DATABASE_READ_URLS and RESPONSE_CACHE_ENABLED are read when the app is imported.
+"""
+
+import os
+import sqlite3
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+from starlette.requests import Request
+
+from app import auth, database
+
+
+def make_request(headers=None, peer="10.0.0.1"):
+    return Request({
+        "type": "http",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()],
+        "client": (peer, 1234) if peer else None,
+    })
+
+
+def test_anonymous_clients_behind_proxy_get_distinct_keys():
+    first = make_request({"X-Forwarded-For": "203.0.113.5, 10.0.0.1"})
+    second = make_request({"X-Forwarded-For": "198.51.100.7, 10.0.0.1"})
+
+    assert database.client_address(first) == "203.0.113.5"
+    assert database.client_key(first) != database.client_key(second)
+
+
+def test_peer_address_without_proxy_headers():
+    assert database.client_address(make_request()) == "10.0.0.1"
+    assert database.client_key(make_request()) != database.client_key(make_request(peer="10.0.0.2"))
+
+
+def test_bearer_token_identifies_client_across_addresses():
+    token = {"Authorization": "Bearer abc"}
+
+    assert database.client_key(make_request({**token, "X-Forwarded-For": "203.0.113.5"})) == \
+        database.client_key(make_request({**token, "X-Forwarded-For": "198.51.100.7"}))
+
+
+def test_unknown_client_is_never_pinned():
+    request = make_request(peer=None)
+
+    assert database.client_key(request) == ""
+    assert database.client_key(make_request({"X-Forwarded-For": ""}, peer=None)) == ""
+
+
+def sync_replica():
+    # The test replica is a SQLite copy of the primary, refreshed on demand
+    primary = sqlite3.connect(database.DATABASE_URL.removeprefix("sqlite:///"))
+    replica = sqlite3.connect(database.DATABASE_READ_URLS[0].removeprefix("sqlite:///"))
+    primary.backup(replica)
+    replica.close()
+    primary.close()
+
+
+@pytest.mark.skipif(not database.DATABASE_READ_URLS, reason="needs a read replica (runs in a child process)")
+def test_author_reads_own_write_after_stale_replica_read(client, db, author, make_post):
+    post = make_post("Body.", title="Before")
+    sync_replica()
+    author_headers = {"Authorization": f"Bearer {auth.create_user_token(author)}", "X-Forwarded-For": "203.0.113.1"}
+
+    update = {"title": "After", "content": "Body.", "excerpt": None, "status": "published", "featured_image": None}
+    assert client.put(f"/api/posts/{post.id}", json=update, headers=author_headers).status_code == 200
+    # Another reader hits the lagging replica right after the write bumped the post's tags
+    stale = client.get(f"/api/posts/{post.slug}", headers={"X-Forwarded-For": "198.51.100.2"})
+    assert stale.json()["title"] == "Before"
+
+    assert client.get(f"/api/posts/{post.slug}", headers=author_headers).json()["title"] == "After"
+    sync_replica()  # caught up: nothing stale was cached for the next reader either
+    assert client.get(f"/api/posts/{post.slug}", headers={"X-Forwarded-For": "198.51.100.3"}).json()["title"] == "After"
+
+
+@pytest.mark.parametrize("response_cache", ["true", "false"])  # off: only the post payload cache is in play
+def test_read_your_writes_with_replica_and_caches(response_cache):
+    directory = tempfile.mkdtemp(prefix="blog-replica-")
+    env = {
+        **os.environ,
+        "DATABASE_URL": f"sqlite:///{directory}/primary.db",
+        "DATABASE_READ_URLS": f"sqlite:///{directory}/replica.db",
+        "RESPONSE_CACHE_ENABLED": response_cache,
+    }
+    result = subprocess.run(
+        [sys.executable, "-m", "pytest", "-q", "-p", "no:cacheprovider",
+         f"{__file__}::test_author_reads_own_write_after_stale_replica_read"],
+        cwd=Path(__file__).resolve().parents[1], env=env, capture_output=True, text=True,
+    )
+    assert result.returncode == 0 and "1 passed" in result.stdout, result.stdout[-4000:] + result.stderr[-2000:]
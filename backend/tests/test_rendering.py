@@ -0,0 +1,102 @@
+import threading
+from datetime import datetime, timedelta
+
+from app import models, rendering
+
+
+def heading_ids(html: str):
+    return [m.group(2) for m in rendering.HEADING_ID_RE.finditer(html)]
+
+
+def test_repeated_headings_get_unique_ids(make_post):
+    post = make_post("## Intro\n\nFirst.\n\n## Intro\n\nSecond.\n\n## Intro\n\nThird.")
+
+    assert heading_ids(post.content_html) == ["intro", "intro_1", "intro_2"]
+    assert [entry["id"] for entry in post.toc] == ["intro", "intro_1", "intro_2"]
+
+
+def test_heading_ids_match_whole_document_render(make_post):
+    content = "# שלום\n\ntext\n\n## Intro\n\n- a\n- b\n\n## Intro\n\n```\ncode\n```\n\n### שלום"
+    post = make_post(content)
+
+    assert heading_ids(post.content_html) == heading_ids(rendering.render_markdown(content))
+
+
+def test_render_diff_keys_map_to_one_html_each(db, make_post):
+    post = make_post("## Intro\n\nFirst.")
+    post.content = "## Intro\n\nFirst.\n\n## Intro\n\nSecond."
+    diff = rendering.render_post(db, post)
+    db.commit()
+
+    assert len(set(diff["order"])) == len(diff["order"])
+    assert 'id="intro_1"' in "".join(diff["changed"].values())
+
+
+def test_purge_render_cache_drops_old_rows(db):
+    old, fresh = "old" + "0" * 61, "new" + "0" * 61
+    db.add_all([
+        models.RenderCache(content_hash=old, html="<p>old</p>",
+                           created_at=datetime.utcnow() - rendering.RENDER_CACHE_MAX_AGE - timedelta(days=1)),
+        models.RenderCache(content_hash=fresh, html="<p>new</p>"),
+    ])
+    db.commit()
+
+    rendering.purge_render_cache(db)
+    db.commit()
+
+    remaining = {h for h, in db.query(models.RenderCache.content_hash).filter(
+        models.RenderCache.content_hash.in_([old, fresh])
+    )}
+    assert remaining == {fresh}
+
+
+def test_concurrent_inserts_purge_once_per_interval(monkeypatch):
+    purges = []
+    monkeypatch.setattr(rendering, "_inserted", 0)
+    monkeypatch.setattr(rendering, "purge_render_cache", lambda db: purges.append(db))
+    threads = [
+        threading.Thread(target=lambda: [rendering._count_inserts(None, 1) for _ in range(1000)])
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(purges) == 8000 // rendering.RENDER_CACHE_PURGE_EVERY
+
+def test_raw_html_is_escaped():
+    html = rendering.render_markdown(
+        '<script>alert(1)</script>\n\nText <img src=x onerror="alert(1)"> inline.\n\n<div onclick="x()">block</div>'
+    )
+
+    assert "<script" not in html
+    assert "<img src=x" not in html
+    assert "<div" not in html
+    assert "&lt;script&gt;" in html
+
+
+def test_unsafe_urls_are_neutralized():
+    html = rendering.render_markdown(
+        "[a](javascript:alert(1)) [b](java\tscript:alert(1)) [c](javascript&#58;alert(1)) "
+        "![d](data:text/html,x) [e](https://example.com/) [f](/posts/x) <https://example.org/>"
+    )
+
+    assert "javascript" not in html.lower()
+    assert "data:" not in html
+    assert 'href="https://example.com/"' in html
+    assert 'href="/posts/x"' in html
+    assert 'href="https://example.org/"' in html
+
+
+def test_stale_html_is_rerendered(client, db, make_post):
+    post = make_post("Hello <script>alert(1)</script>")
+    post.content_html = "<p>Hello <script>alert(1)</script></p>"
+    post.content_hash = "stale"
+    db.commit()
+
+    response = client.get(f"/api/posts/{post.slug}/html")
+
+    assert response.status_code == 200
+    assert "<script" not in response.text
+    assert "&lt;script&gt;" in response.text
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import create_engine, inspect, text
+
+from app import crud, models, rollup
+from app.ingest import page_view_ingestor
+
+
+def fold_everything(db) -> int:
+    # Claim up to the present by the database clock, ignoring the grace period
+    return rollup.run_rollup(db, now=rollup._database_now(db) + timedelta(seconds=rollup.ROLLUP_GRACE_SECONDS + 1))
+
+
+def test_late_written_view_is_still_folded(db, make_post):
+    post = make_post("Counted.")
+    rollup.run_rollup(db)  # a regular run claims the window up to now - grace
+
+    # Queued two hours ago, written only now: its viewed_at is behind the watermark
+    viewed_at = datetime.utcnow().replace(microsecond=0) - timedelta(hours=2)
+    crud.bulk_create_page_views(db, [{"post_id": post.id, "referrer": "https://www.example.com/a", "viewed_at": viewed_at}])
+
+    assert fold_everything(db) == 1
+    hourly = db.query(models.PageViewHourly).filter(models.PageViewHourly.post_id == post.id).one()
+    assert (hourly.bucket.replace(tzinfo=None), hourly.referrer, hourly.views) == (
+        viewed_at.replace(minute=0, second=0), "example.com", 1
+    )
+    assert fold_everything(db) == 0  # never folded twice
+
+
+def test_tracked_view_records_country_from_edge_header(client, db, make_post):
+    post = make_post("Visited.")
+    response = client.post("/api/analytics/view", json={
+        "post_id": str(post.id), "visitor_ip": None, "user_agent": "test", "referrer": None
+    }, headers={"CF-IPCountry": "il"})
+    assert response.status_code == 202
+    page_view_ingestor.stop()  # joins the writer (it may hold the row) and flushes the rest
+    page_view_ingestor.start()
+
+    countries = [c for c, in db.query(models.PageView.country).filter(models.PageView.post_id == post.id)]
+    assert countries == ["IL"]
+
+
+def daily_views(db, post_id) -> int:
+    return sum(views for views, in db.query(models.PageViewDaily.views).filter(models.PageViewDaily.post_id == post_id))
+
+
+def test_views_without_ingested_at_are_backfilled_once(db, make_post):
+    post = make_post("Historical.")
+    rollup.run_rollup(db)
+    now = datetime.now(timezone.utc).replace(microsecond=0)
+    # Written before ingested_at existed: one the watermark has passed, one it has not
+    crud.bulk_create_page_views(db, [
+        {"post_id": post.id, "viewed_at": now - timedelta(days=3)},
+        {"post_id": post.id, "viewed_at": now + timedelta(minutes=5)},
+    ])
+    db.query(models.PageView).filter(models.PageView.post_id == post.id).update({models.PageView.ingested_at: None})
+    db.commit()
+
+    assert rollup.run_rollup(db) == 1
+    assert db.query(models.PageView).filter(
+        models.PageView.post_id == post.id, models.PageView.ingested_at.is_(None)
+    ).count() == 0
+    rollup.run_rollup(db, now=now + timedelta(minutes=10, seconds=rollup.ROLLUP_GRACE_SECONDS))
+    fold_everything(db)
+
+    assert daily_views(db, post.id) == 2
+
+
+def test_ensure_ingested_at_migrates_old_table(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path}/old.db")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE page_views (id VARCHAR(36) PRIMARY KEY, viewed_at DATETIME)"))
+
+    rollup.ensure_ingested_at(engine)
+    rollup.ensure_ingested_at(engine)  # idempotent
+
+    assert "ingested_at" in {column["name"] for column in inspect(engine).get_columns("page_views")}
+    assert "ix_page_views_ingested_at" in {index["name"] for index in inspect(engine).get_indexes("page_views")}
+
+
+def test_timestamps_normalize_to_utc():
+    israel = timezone(timedelta(hours=3))
+
+    assert rollup._utc(datetime(2024, 5, 1, 2, 30, tzinfo=israel)) == datetime(2024, 4, 30, 23, 30, tzinfo=timezone.utc)
+    assert rollup._utc(datetime(2024, 5, 1, 2, 30)).tzinfo is timezone.utc
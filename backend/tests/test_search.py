@@ -0,0 +1,64 @@
+from sqlalchemy import func
+
+from app import crud, models, search_index
+
+
+def term_counts(db, term):
+    row = db.query(models.SearchTerm.documents, models.SearchTerm.surface_documents).filter(
+        models.SearchTerm.term == search_index.normalize(term)
+    ).first()
+    return tuple(row) if row else (0, 0)
+
+
+def test_completion_skips_prefix_stripped_forms(db, make_post):
+    dogs = make_post("הכלבים נובחים בחצר", title="זנבות")
+    hearts = make_post("לבבות שבורים", title="זנבות")
+
+    found = {post_id for post_id, _ in search_index.rank(db, "זנבות לב")}
+
+    assert hearts.id in found
+    assert dogs.id not in found  # only via לבים, stripped from הכלבים
+
+
+def test_exact_word_still_matches_prefixed_forms(db, make_post):
+    post = make_post("ובשמיכות חמות", title="חורף")
+
+    assert post.id in {post_id for post_id, _ in search_index.rank(db, "שמיכות", prefix_last=False)}
+
+
+def test_counters_follow_index_and_remove(db, make_post):
+    before = db.get(models.SearchStats, 1)
+    documents, total_length = (before.documents, before.total_length) if before else (0, 0)
+    post = make_post("צפרדעים וצפרדעים", title="ביצה")
+    db.expire_all()
+
+    assert term_counts(db, "וצפרדעים") == (1, 1)
+    assert term_counts(db, "צפרדעים") == (1, 1)
+    stats = db.get(models.SearchStats, 1)
+    assert stats.documents == documents + 1
+    assert stats.total_length == total_length + search_index.document_terms(post)[2]
+
+    crud.delete_post(db, post.id)
+    db.expire_all()
+
+    assert term_counts(db, "צפרדעים") == (0, 0)
+    assert db.get(models.SearchStats, 1).documents == documents
+
+
+def test_counters_match_a_rebuild(db, make_post):
+    search_index.rebuild_index(db)
+    make_post("ארנבים בשדה", title="ארנב")
+    make_post("הארנבים ישנים", title="שינה", status="draft")
+
+    def snapshot():
+        terms = dict(db.query(models.SearchTerm.term, models.SearchTerm.documents).filter(
+            models.SearchTerm.documents > 0
+        ).all())
+        stats = db.query(models.SearchStats.documents, models.SearchStats.total_length).one()
+        return terms, tuple(stats)
+
+    incremental = snapshot()
+    search_index.rebuild_index(db)
+
+    assert snapshot() == incremental
+    assert incremental[1][0] == db.query(func.count(models.SearchDocument.post_id)).scalar()